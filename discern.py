@@ -21,24 +21,18 @@ class SlideCrack:
 
     @staticmethod
     def clear_white(img):
+        """
+        裁掉滑块图四周的灰白背景: 三个通道不全相等的像素视为滑块, 按其所在行/列的范围裁剪
+        与原逐像素实现的裁剪方式一致: 不统计第 0 行/列, 裁剪区间不含最后一行/列
+        """
         img = cv2.imdecode((np.frombuffer(img, np.uint8)), cv2.IMREAD_COLOR)
-        rows, cols, channel = img.shape
-        min_x = 255
-        min_y = 255
-        max_x = 0
-        max_y = 0
-        for x in range(1, rows):
-            for y in range(1, cols):
-                t = set(img[x, y])
-                if len(t) >= 2:
-                    if x <= min_x:
-                        min_x = x
-                    elif x >= max_x:
-                        max_x = x
-                    if y <= min_y:
-                        min_y = y
-                    elif y >= max_y:
-                        max_y = y
+        mask = (img[1:, 1:, 0] != img[1:, 1:, 1]) | (img[1:, 1:, 1] != img[1:, 1:, 2])
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if not rows.size:
+            return img[0:0, 0:0]
+        min_x, max_x = rows[0] + 1, rows[-1] + 1
+        min_y, max_y = cols[0] + 1, cols[-1] + 1
         img1 = img[min_x:max_x, min_y: max_y]
         return img1
 
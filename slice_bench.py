@@ -0,0 +1,228 @@
+# -*- coding: UTF-8 -*-
+# @author:
+# @file: slice_bench
+# @time: 2026-10-18
+# @desc: 切片下载基准测试: 本地 Range 服务, 扫描切片大小/并发数/模式, 输出可对比的 JSON
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from loguru import logger
+
+from slice_mock import RangeServer
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块, 不统计内存峰值
+    resource = None
+
+MB = 1024 * 1024
+
+
+def peak_rss_mb():
+    """当前进程的内存峰值(mb), linux 下 ru_maxrss 单位为 KB, macOS 为字节"""
+    if not resource:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak *= 1024
+    return round(peak / MB, 2)
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def run_case(url, mode, config, expected_md5, queue):
+    """子进程中执行单次下载, 保证内存峰值互不影响"""
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    from slice_download import AsyncSliceDownload, ThreadSliceDownload
+
+    slice_latency = []
+
+    def record(event):
+        if event["event"] == "slice":
+            slice_latency.append(event["elapsed"])
+
+    config = dict(config, slice_hooks=[record])
+    if mode == "thread":
+        downloader = ThreadSliceDownload(url, "GET", **config)
+        start_time = time.perf_counter()
+        state, content = downloader.download_sync()
+    else:
+        downloader = AsyncSliceDownload(url, "GET", **config)
+        start_time = time.perf_counter()
+        state, content = asyncio.run(downloader.download())
+    seconds = time.perf_counter() - start_time
+    if isinstance(content, str):
+        file_hash = hashlib.md5()
+        with open(content, "rb") as f:
+            for chunk in iter(lambda: f.read(MB), b""):
+                file_hash.update(chunk)
+        md5 = file_hash.hexdigest()
+        os.remove(content)
+    else:
+        md5 = hashlib.md5(content).hexdigest()
+    queue.put({
+        "state": state,
+        "ok": state == 2 and md5 == expected_md5,
+        "seconds": round(seconds, 4),
+        "slices": len(slice_latency),
+        "slice_p50": round(percentile(slice_latency, 50) or 0, 4),
+        "slice_p99": round(percentile(slice_latency, 99) or 0, 4),
+        "retries": downloader.events.retries,
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+
+def bench_case(server, mode, config, expected_md5, timeout):
+    """启动子进程执行一次下载, 返回结果(附加请求数与吞吐)"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    requests_before = server.requests
+    process = context.Process(target=run_case, args=(server.url, mode, config, expected_md5, queue))
+    process.start()
+    try:
+        result = queue.get(timeout=timeout)
+    except Exception:
+        result = {"state": 1, "ok": False, "error": "timeout"}
+    process.join(5)
+    if process.is_alive():
+        process.kill()
+    result["requests"] = server.requests - requests_before
+    if result.get("seconds"):
+        result["mb_s"] = round(len(server.data) / MB / result["seconds"], 2)
+    return result
+
+
+def run_bench(args):
+    extra_config = json.loads(args.config) if args.config else {}
+    results = []
+    with RangeServer(size=args.size * MB, latency=args.latency, bandwidth=args.bandwidth * MB,
+                     error_rate=args.error_rate, truncate_rate=args.truncate_rate, seed=args.seed) as server:
+        expected_md5 = hashlib.md5(server.data).hexdigest()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for mode, slice_size, semaphore in itertools.product(args.modes, args.slice_sizes, args.semaphores):
+                config = {
+                    "slice_size": slice_size * 1024,
+                    "slice_min_size": min(slice_size * 1024, args.size * MB - 1),
+                    "slice_semaphore": semaphore,
+                    "slice_cache": False,
+                    "slice_backoff_base": 0.05,
+                    "slice_mode": mode,
+                    **extra_config,
+                }
+                if args.disk:
+                    config["save_path"] = os.path.join(tmp_dir, f"{mode}-{slice_size}-{semaphore}.bin")
+                runs = [bench_case(server, mode, config, expected_md5, args.timeout) for _ in range(args.repeat)]
+                ok_runs = [run for run in runs if run["ok"]]
+                # 多次重复取吞吐中位数的一次作为结果
+                ok_runs.sort(key=lambda run: run["mb_s"])
+                result = dict(ok_runs[len(ok_runs) // 2] if ok_runs else runs[-1])
+                result.update({
+                    "case": f"{mode}-{slice_size}k-{semaphore}",
+                    "mode": mode,
+                    "slice_size": slice_size * 1024,
+                    "slice_semaphore": semaphore,
+                    "success_runs": len(ok_runs),
+                    "runs_mb_s": [run.get("mb_s") for run in runs],
+                })
+                logger.info(f"【{result['case']}】{result.get('mb_s')}mb/s, p50:{result.get('slice_p50')}s, "
+                            f"p99:{result.get('slice_p99')}s, 内存峰值:{result.get('peak_rss_mb')}mb, "
+                            f"请求数:{result['requests']}, 成功:{len(ok_runs)}/{len(runs)}")
+                results.append(result)
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "file_size": args.size * MB,
+            "disk": args.disk,
+            "repeat": args.repeat,
+            "server": {
+                "latency": args.latency,
+                "bandwidth": args.bandwidth * MB,
+                "error_rate": args.error_rate,
+                "truncate_rate": args.truncate_rate,
+                "seed": args.seed,
+            },
+            "config": extra_config,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """与基线报告对比, 吞吐下降超过 threshold 或成功率下降视为回退, 返回回退列表"""
+    baseline_results = {result["case"]: result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = baseline_results.get(result["case"])
+        if not old:
+            continue
+        success_rate = result["success_runs"] / len(result["runs_mb_s"])
+        old_success_rate = old["success_runs"] / len(old["runs_mb_s"])
+        if success_rate < old_success_rate:
+            regressions.append(f"【{result['case']}】成功率 {old_success_rate:.0%} -> {success_rate:.0%}")
+        elif old.get("mb_s") and result.get("mb_s") and result["mb_s"] < old["mb_s"] * (1 - threshold):
+            regressions.append(f"【{result['case']}】吞吐 {old['mb_s']}mb/s -> {result['mb_s']}mb/s")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="切片下载基准测试")
+    parser.add_argument("--size", type=int, default=64, help="测试文件大小(mb)")
+    parser.add_argument("--modes", nargs="+", default=["async", "thread"], choices=["async", "thread"])
+    parser.add_argument("--slice-sizes", nargs="+", type=int, default=[512, 2048, 8192], help="切片大小(kb)")
+    parser.add_argument("--semaphores", nargs="+", type=int, default=[8, 32], help="切片并发数")
+    parser.add_argument("--repeat", type=int, default=3, help="每组参数重复次数")
+    parser.add_argument("--disk", action="store_true", help="落盘模式(save_path)")
+    parser.add_argument("--config", default=None, help="额外的下载参数(JSON), 如 '{\"slice_adaptive\": true}'")
+    parser.add_argument("--latency", type=float, default=0.0, help="服务端首字节延迟(秒)")
+    parser.add_argument("--bandwidth", type=float, default=0, help="服务端单连接带宽上限(mb/s), 0 不限速")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="服务端随机 5xx 概率")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="服务端截断响应体概率")
+    parser.add_argument("--seed", type=int, default=0, help="测试文件内容种子")
+    parser.add_argument("--timeout", type=float, default=300, help="单次下载超时(秒)")
+    parser.add_argument("--output", default=None, help="结果 JSON 保存路径, 默认输出到 stdout")
+    parser.add_argument("--baseline", default=None, help="基线 JSON, 吞吐回退时退出码为 1")
+    parser.add_argument("--threshold", type=float, default=0.1, help="吞吐回退阈值(比例)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_bench(args)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        logger.info(f"基准测试结果已保存至:{args.output}")
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for regression in regressions:
+            logger.error(f"性能回退:{regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,25 +5,1787 @@
 # @desc: 切片下载
 
 import asyncio
-import copy
+import base64
 import hashlib
+import heapq
+import itertools
+import json
+import mmap
+import multiprocessing
 import os
+import queue
+import random
 import shutil
-from concurrent.futures import ThreadPoolExecutor
+import statistics
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlparse, urlsplit, urlunsplit
 
 import aiofiles
 import httpx
 import requests
 import urllib3
 from loguru import logger
+from requests.adapters import HTTPAdapter
+
+try:
+    import h2  # noqa: F401 httpx 开启 http2 需要 h2 库
+except ImportError:
+    h2 = None
+
+try:
+    import fcntl  # 内容存储跨进程文件锁, windows 下使用 msvcrt
+    msvcrt = None
+except ImportError:
+    import msvcrt
+    fcntl = None
+
+try:
+    from tqdm import tqdm  # 进度条适配 TqdmProgress 需要 tqdm
+except ImportError:
+    tqdm = None
+
+try:
+    import crypto  # 流式解密变换复用 crypto.AesCipher, 需要 pycryptodome
+except ImportError:
+    crypto = None
+
+try:
+    import zstandard  # zstd 流式解压变换需要 zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import xxhash  # 切片校验和优先使用 xxhash, 未安装时使用 zlib.crc32
+except ImportError:
+    xxhash = None
 
 urllib3.disable_warnings()
 
 
-def myhash(text):
-    hash_lib = hashlib.md5()
-    hash_lib.update(text.encode("utf-8"))
-    return hash_lib.hexdigest()
+def myhash(text):
+    hash_lib = hashlib.md5()
+    hash_lib.update(text.encode("utf-8"))
+    return hash_lib.hexdigest()
+
+
+class CountingAdapter(HTTPAdapter):
+    """统计传输层新建的连接数: 汇总 urllib3 连接池的 num_connections, 连接池被淘汰或关闭前先累加"""
+
+    def __init__(self, *args, **kwargs):
+        self.disposed_connections = 0  # 已淘汰/关闭的连接池新建过的连接数
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.track(self.poolmanager)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        tracked = proxy in self.proxy_manager
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        if not tracked:
+            self.track(manager)
+        return manager
+
+    def track(self, manager):
+        dispose = manager.pools.dispose_func
+
+        def dispose_func(pool):
+            self.disposed_connections += pool.num_connections
+            if dispose:
+                dispose(pool)
+
+        manager.pools.dispose_func = dispose_func
+
+    def connections(self):
+        total = self.disposed_connections
+        for manager in [self.poolmanager, *self.proxy_manager.values()]:
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                total += pool.num_connections if pool else 0
+        return total
+
+
+class ClientPool:
+    """
+    连接池: 每个代理出口维护长连接客户端, 在切片、重试以及多次下载之间复用
+    异步模式使用 httpx.AsyncClient(安装 h2 时开启 http2 多路复用), 多线程模式使用 requests.Session
+    注意: httpx.AsyncClient 绑定事件循环, 跨下载复用时需在同一个事件循环内
+    """
+
+    def __init__(self, max_connections=20, http2=True, verify=False):
+        """
+        :param max_connections: 每个客户端最大连接数(keep-alive 连接数与之相同), 一般与 slice_semaphore 保持一致;
+                                多线程模式下每个代理最多保留的空闲 Session 数
+        :param http2: 是否开启 http2(需要安装 h2)
+        :param verify: 是否校验证书
+        """
+        self.max_connections = max_connections
+        self.http2 = bool(http2 and h2)
+        self.verify = verify
+        self.async_clients = {}  # proxy -> httpx.AsyncClient
+        self.sessions = {}  # proxy -> 空闲的 requests.Session 列表, 用完归还, 不随线程数增长
+        self.busy_sessions = 0  # 借出未归还的 Session 数
+        self.requests = 0  # 经过连接池发出的请求数
+        self.connections = 0  # httpx 传输层新建的连接数, requests 的连接数由 CountingAdapter 统计
+        self.closed_connections = 0  # 已关闭的 Session 新建过的连接数
+        self.closed = False  # 关闭后不再新建客户端, 避免后台线程在下载结束后泄漏连接
+        self.lock = threading.Lock()
+
+    async def trace(self, name, info):
+        """httpcore trace 回调, 统计新建的 TCP 连接(含到代理的连接)"""
+        if name.endswith("connect_tcp.complete"):
+            self.connections += 1
+
+    async def on_request(self, request):
+        request.extensions["trace"] = self.trace
+
+    def get_async_client(self, proxy=""):
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("连接池已关闭")
+            self.requests += 1
+            client = self.async_clients.get(proxy)
+            if client is not None and not client.is_closed:
+                return client
+            proxies = None
+            if proxy:
+                proxies = {
+                    "http://": "http://{}".format(proxy),
+                    "https://": "https://{}".format(proxy)
+                }
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            client = httpx.AsyncClient(proxies=proxies, trust_env=False, verify=self.verify, http2=self.http2,
+                                       limits=limits, event_hooks={"request": [self.on_request]})
+            self.async_clients[proxy] = client
+            return client
+
+    def get_session(self, proxy=""):
+        """
+        借出一个 requests.Session(非线程安全, 同一时间只给一个线程使用), 用完必须调用 release_session 归还
+        """
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("连接池已关闭")
+            self.requests += 1
+            self.busy_sessions += 1
+            idle = self.sessions.get(proxy)
+            if idle:
+                return idle.pop()
+        session = requests.Session()
+        session.trust_env = False
+        session.verify = self.verify
+        adapter = CountingAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if proxy:
+            session.proxies = {
+                "http": "{}".format(proxy),
+                "https": "{}".format(proxy)
+            }
+        return session
+
+    def release_session(self, proxy, session):
+        """归还 Session, 每个代理最多保留 max_connections 个空闲 Session, 多余的以及关闭后归还的直接关闭"""
+        with self.lock:
+            self.busy_sessions -= 1
+            idle = self.sessions.setdefault(proxy, [])
+            if not self.closed and len(idle) < self.max_connections:
+                idle.append(session)
+                return
+        self.close_session(session)
+
+    def close_session(self, session):
+        session.close()
+        with self.lock:
+            self.closed_connections += session.get_adapter("http://").connections()
+
+    def stats(self):
+        """连接复用统计: 传输层新建连接数越少、reuse_rate 越高说明省下的握手越多"""
+        with self.lock:
+            sessions = [session for idle in self.sessions.values() for session in idle]
+            connections = self.connections + self.closed_connections
+            requests_count = self.requests
+            clients = len(self.async_clients) + len(sessions) + self.busy_sessions
+        connections += sum(session.get_adapter("http://").connections() for session in sessions)
+        return {
+            "requests": requests_count,
+            "connections": connections,
+            "reuse_rate": round(max(0, 1 - connections / requests_count), 4) if requests_count else 0,
+            "clients": clients,
+        }
+
+    async def aclose(self):
+        with self.lock:
+            clients = list(self.async_clients.values())
+            self.async_clients = {}
+        for client in clients:
+            await client.aclose()
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            sessions = [session for idle in self.sessions.values() for session in idle]
+            self.sessions = {}
+        for session in sessions:
+            self.close_session(session)
+
+    def evict(self, proxy):
+        """代理被剔除后关闭其客户端"""
+        with self.lock:
+            client = self.async_clients.pop(proxy, None)
+            sessions = self.sessions.pop(proxy, [])
+        for session in sessions:
+            self.close_session(session)
+        if client is not None:
+            try:
+                asyncio.get_running_loop().create_task(client.aclose())
+            except RuntimeError:
+                pass
+
+
+class ProxyStat:
+    """单个代理的健康统计"""
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.leases = 0
+        self.in_flight = 0
+        self.success = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = None  # 请求耗时 EWMA(秒)
+        self.speed = None  # 吞吐 EWMA(字节/秒)
+        self.cooldown_until = 0
+
+    def success_rate(self):
+        return (self.success + 1) / (self.success + self.failures + 2)
+
+    def score(self):
+        """
+        越小越优先: 未测速且没有在途请求的代理优先试探, 已测速的代理按 预计等待耗时 / 成功率 排序,
+        试探请求尚未返回的未测速代理排在最后, 避免并发请求全部压到同一个未知代理上
+        """
+        if self.latency is None:
+            return (0, 0) if self.in_flight == 0 else (2, self.in_flight)
+        return 1, (self.in_flight + 1) * self.latency / self.success_rate()
+
+
+class ProxyPool:
+    """
+    代理池: 按健康度把代理租给切片请求, 统计每个代理的成功率、耗时与吞吐
+    失败的代理按指数退避冷却, 连续失败 max_failures 次剔除; 可用代理不足时通过 fetch 获取新代理
+    每个代理在 ClientPool 中对应一个长连接客户端, 剔除时一并关闭
+    """
+
+    def __init__(self, proxies=None, fetch=None, max_failures=3, cooldown=5, max_cooldown=120, max_size=20):
+        """
+        :param proxies: 初始代理列表 ip:port
+        :param fetch: 获取新代理的函数, 返回 ip:port, 返回空表示没有可用代理
+        :param max_failures: 连续失败多少次剔除
+        :param cooldown: 首次失败的冷却时间(秒), 之后每次翻倍
+        :param max_cooldown: 最大冷却时间(秒)
+        :param max_size: 代理池最大代理数
+        """
+        self.fetch = fetch
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_size = max_size
+        self.proxies = {}  # proxy -> ProxyStat
+        self.evicted = 0
+        self.lock = threading.Lock()
+        for proxy in proxies or []:
+            self.add(proxy)
+
+    def add(self, proxy):
+        with self.lock:
+            if proxy and proxy not in self.proxies:
+                self.proxies[proxy] = ProxyStat(proxy)
+
+    def lease(self):
+        """租用一个代理: 优先不在冷却中的代理, 全部在冷却时返回最早结束冷却的代理, 代理池为空时返回空字符串(直连)"""
+        now = time.monotonic()
+        with self.lock:
+            ready = [stat for stat in self.proxies.values() if stat.cooldown_until <= now]
+        if not ready and self.fetch and len(self.proxies) < self.max_size:
+            self.add(self.fetch())
+            with self.lock:
+                ready = [stat for stat in self.proxies.values() if stat.cooldown_until <= now]
+        with self.lock:
+            if not ready:
+                ready = sorted(self.proxies.values(), key=lambda stat: stat.cooldown_until)[:1]
+            if not ready:
+                return ""
+            stat = min(ready, key=ProxyStat.score)
+            stat.leases += 1
+            stat.in_flight += 1
+            return stat.proxy
+
+    def release(self, proxy, success=True, elapsed=0, size=0):
+        """
+        归还代理并记录结果
+        :return: True 表示该代理已被剔除, 调用方应关闭其连接
+        """
+        with self.lock:
+            stat = self.proxies.get(proxy)
+            if stat is None:
+                return False
+            stat.in_flight = max(0, stat.in_flight - 1)
+            if success:
+                stat.success += 1
+                stat.consecutive_failures = 0
+                stat.latency = elapsed if stat.latency is None else stat.latency * 0.7 + elapsed * 0.3
+                if size:
+                    speed = size / max(elapsed, 1e-3)
+                    stat.speed = speed if stat.speed is None else stat.speed * 0.7 + speed * 0.3
+                return False
+            stat.failures += 1
+            stat.consecutive_failures += 1
+            if stat.consecutive_failures >= self.max_failures:
+                self.proxies.pop(proxy)
+                self.evicted += 1
+                logger.warning(f"代理{proxy}连续失败{stat.consecutive_failures}次,已剔除")
+                return True
+            cooldown = min(self.max_cooldown, self.cooldown * 2 ** (stat.consecutive_failures - 1))
+            stat.cooldown_until = time.monotonic() + cooldown
+            return False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "evicted": self.evicted,
+                "proxies": [{
+                    "proxy": stat.proxy,
+                    "leases": stat.leases,
+                    "success_rate": round(stat.success_rate(), 4),
+                    "latency": round(stat.latency or 0, 3),
+                    "speed": round((stat.speed or 0) / (1024 * 1024), 2),
+                    "cooling": stat.cooldown_until > time.monotonic(),
+                } for stat in self.proxies.values()],
+            }
+
+
+class CircuitBreaker:
+    """
+    单 host 熔断器: 连续失败 threshold 次后熔断 reset_timeout 秒, 熔断期间该 host 的请求先等待再发出,
+    到期后进入半开状态, 只放行一个试探请求, 成功则恢复, 失败则再次熔断
+    """
+
+    def __init__(self, threshold=10, reset_timeout=10, probe_interval=0.5):
+        """
+        :param probe_interval: 半开状态下其他请求轮询试探结果的间隔(秒)
+        """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.probe_interval = probe_interval
+        self.failures = {}  # host -> 连续失败次数
+        self.open_until = {}  # host -> 熔断结束时间
+        self.probe_until = {}  # host -> 试探请求的截止时间, 试探请求被取消未回报结果时到期后放行下一个
+        self.lock = threading.Lock()
+
+    def wait_time(self, host):
+        """
+        发出请求前还需等待的秒数, 返回 0 表示可以立即发出
+        半开状态下返回 0 的调用方即为试探请求, 必须随后调用 record 回报结果
+        """
+        with self.lock:
+            open_until = self.open_until.get(host)
+            if open_until is None:
+                return 0.0
+            now = time.monotonic()
+            if now < open_until:
+                return open_until - now
+            probe_until = self.probe_until.get(host, 0)
+            if now < probe_until:
+                return min(self.probe_interval, probe_until - now)
+            self.probe_until[host] = now + self.reset_timeout
+            return 0.0
+
+    def record(self, host, success):
+        with self.lock:
+            if success:
+                self.failures.pop(host, None)
+                self.open_until.pop(host, None)
+                self.probe_until.pop(host, None)
+                return
+            self.failures[host] = self.failures.get(host, 0) + 1
+            now = time.monotonic()
+            if self.failures[host] >= self.threshold and self.open_until.get(host, 0) <= now:
+                self.probe_until.pop(host, None)
+                self.open_until[host] = now + self.reset_timeout
+                logger.warning(f"【{host}】连续失败{self.failures[host]}次,熔断{self.reset_timeout}s")
+
+
+class RetryPolicy:
+    """
+    切片重试策略: 指数退避 + 全抖动(full jitter), 优先遵循 Retry-After, 并结合单 host 熔断器
+    可在多个下载之间共享, 使熔断状态对同一 host 的所有下载生效
+    """
+
+    def __init__(self, retry_times=10, backoff_base=0.5, backoff_max=10, breaker=None):
+        """
+        :param retry_times: 单个切片最大尝试次数
+        :param backoff_base: 退避基数(秒), 第 n 次重试最长等待 backoff_base * 2 ** (n - 1)
+        :param backoff_max: 退避上限(秒), 同时也是 Retry-After 的上限
+        :param breaker: CircuitBreaker, 为 None 时不熔断
+        """
+        self.retry_times = retry_times
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker
+
+    @classmethod
+    def from_kwargs(cls, request_kwargs):
+        """根据切片配置创建重试策略"""
+        return cls(
+            request_kwargs.get("slice_retry_times", 10),
+            backoff_base=request_kwargs.get("slice_backoff_base", 0.5),  # 重试退避基数(秒)
+            backoff_max=request_kwargs.get("slice_backoff_max", 10),  # 重试退避上限(秒)
+            breaker=CircuitBreaker(request_kwargs.get("slice_breaker_threshold", 10),  # 单 host 连续失败多少次熔断
+                                   request_kwargs.get("slice_breaker_timeout", 10)))  # 熔断时间(秒)
+
+    @staticmethod
+    def retry_after(response):
+        """解析 Retry-After(秒数或 HTTP 日期), 没有时返回 None"""
+        if response is None:
+            return None
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt, response=None):
+        """第 attempt 次失败后的等待时间"""
+        retry_after = self.retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def wait_time(self, url):
+        return self.breaker.wait_time(urlparse(url).netloc) if self.breaker else 0
+
+    def record(self, url, success):
+        if self.breaker:
+            self.breaker.record(urlparse(url).netloc, success)
+
+
+class PrioritySemaphore:
+    """异步优先级信号量: 名额不足时按 priority 从小到大唤醒等待者, 同优先级先到先得"""
+
+    def __init__(self, value):
+        self.value = value
+        self.waiters = []  # (priority, seq, future)
+        self.seq = itertools.count()
+
+    async def acquire(self, priority=0):
+        if self.value > 0 and not self.waiters:
+            self.value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # 已分到名额但被取消, 转交给下一个等待者
+            raise
+
+    def release(self):
+        while self.waiters:
+            future = heapq.heappop(self.waiters)[2]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.value += 1
+
+
+class ConnectionBudget:
+    """多个下载共享的连接预算: 全局并发上限 + 单 host 并发上限, 名额按优先级分配"""
+
+    def __init__(self, max_connections=50, max_host_connections=10):
+        self.max_host_connections = max_host_connections
+        self.global_semaphore = PrioritySemaphore(max_connections)
+        self.host_semaphores = {}
+
+    def slot(self, url, priority=0):
+        host = urlparse(url).netloc
+        if host not in self.host_semaphores:
+            self.host_semaphores[host] = PrioritySemaphore(self.max_host_connections)
+        return BudgetSlot(self.global_semaphore, self.host_semaphores[host], priority)
+
+
+class BudgetSlot:
+    """可用于 async with 的预算名额, 先占 host 名额再占全局名额, 避免排队时空占全局连接"""
+
+    def __init__(self, global_semaphore, host_semaphore, priority=0):
+        self.global_semaphore = global_semaphore
+        self.host_semaphore = host_semaphore
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.host_semaphore.acquire(self.priority)
+        try:
+            await self.global_semaphore.acquire(self.priority)
+        except BaseException:
+            self.host_semaphore.release()
+            raise
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.global_semaphore.release()
+        self.host_semaphore.release()
+
+
+class TokenBucket:
+    """令牌桶: rate 为每秒字节数, burst 为桶容量(默认 1 秒的量); rate 为 0 时不限速, 可在运行时通过 set_rate 修改"""
+
+    def __init__(self, rate=0, burst=None):
+        self.lock = threading.Lock()
+        self.rate = 0
+        self.burst = 0
+        self.tokens = 0
+        self.updated = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        with self.lock:
+            self.refill(time.monotonic())
+            self.rate = rate or 0
+            self.burst = burst or max(self.rate, 64 * 1024)
+            self.tokens = min(self.tokens, self.burst)
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, size, now=None):
+        """预约 size 个令牌(允许透支), 返回需要等待的秒数; 先预约先得, 多个切片/下载按到达顺序交替放行"""
+        with self.lock:
+            if not self.rate:
+                return 0
+            self.refill(now or time.monotonic())
+            self.tokens -= size
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class BandwidthLimiter:
+    """
+    带宽整形: 全局与单 host 两级令牌桶, 可在多个下载(以及 BatchDownloader)间共享, 限速值可在运行时修改
+    切片响应体按块读取, 每块向全局、host 以及下载自身(slice_rate_limit)的令牌桶预约, 等待其中最长的时间
+        limiter = BandwidthLimiter(rate=50 * 1024 * 1024, host_rate=10 * 1024 * 1024)
+        AsyncSliceDownload(url, "GET", bandwidth_limiter=limiter, slice_rate_limit=2 * 1024 * 1024)
+        limiter.set_host_rate("example.com", 20 * 1024 * 1024)
+    """
+
+    def __init__(self, rate=0, host_rate=0, host_rates=None):
+        """
+        :param rate: 全局限速(字节/秒), 0 不限速
+        :param host_rate: 未单独设置的 host 的默认限速(字节/秒), 0 不限速
+        :param host_rates: {host: 限速}
+        """
+        self.global_bucket = TokenBucket(rate)
+        self.host_rate = host_rate
+        self.host_rates = dict(host_rates or {})
+        self.host_buckets = {}
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate, burst=None):
+        self.global_bucket.set_rate(rate, burst)
+
+    def set_host_rate(self, host, rate, burst=None):
+        with self.lock:
+            self.host_rates[host] = rate
+            bucket = self.host_buckets.get(host)
+        if bucket:
+            bucket.set_rate(rate, burst)
+
+    def host_bucket(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.host_buckets.get(host)
+            if bucket is None:
+                bucket = self.host_buckets[host] = TokenBucket(self.host_rates.get(host, self.host_rate))
+            return bucket
+
+    def reserve(self, url, size):
+        now = time.monotonic()
+        return max(self.global_bucket.reserve(size, now), self.host_bucket(url).reserve(size, now))
+
+
+class SliceSource:
+    """切片下载源: 镜像 url 和/或代理出口"""
+
+    def __init__(self, url, proxy=""):
+        self.url = url
+        self.proxy = proxy
+        self.speed = None  # 单请求吞吐 EWMA(字节/秒)
+        self.in_flight = 0
+        self.failures = 0  # 连续失败次数
+        self.alive = True
+
+    def __repr__(self):
+        return f"SliceSource({self.url!r}, proxy={self.proxy!r})"
+
+
+class SourcePool:
+    """
+    多源调度: 每个切片请求选择预计完成最早的源((在途请求数 + 1) / 实测吞吐), 未测速的源优先试探
+    返回错误文件大小的源立即剔除, 连续失败 max_failures 次的源剔除, 但始终保留最后一个可用源
+    """
+
+    def __init__(self, sources, max_failures=3):
+        self.sources = sources
+        self.max_failures = max_failures
+        self.lock = threading.Lock()
+
+    def alive_sources(self):
+        return [source for source in self.sources if source.alive]
+
+    def choose(self):
+        with self.lock:
+            sources = self.alive_sources() or self.sources[:1]
+
+            def score(source):
+                if source.speed is None:
+                    return 0, source.in_flight
+                return (source.in_flight + 1) / source.speed, source.in_flight
+
+            return min(sources, key=score)
+
+    def record(self, source, size=0, elapsed=0, success=True):
+        with self.lock:
+            if success:
+                speed = size / max(elapsed, 1e-3)
+                source.speed = speed if source.speed is None else source.speed * 0.7 + speed * 0.3
+                source.failures = 0
+                return
+            source.failures += 1
+        if source.failures >= self.max_failures:
+            self.drop(source, f"连续失败{source.failures}次")
+
+    def drop(self, source, reason):
+        with self.lock:
+            if not source.alive or len(self.alive_sources()) <= 1:
+                return
+            source.alive = False
+        logger.warning(f"【{source.url}】剔除下载源(proxy:{source.proxy or '无'}):{reason}")
+
+    def stats(self):
+        return [{"url": source.url, "proxy": source.proxy, "alive": source.alive,
+                 "speed": round((source.speed or 0) / (1024 * 1024), 2)} for source in self.sources]
+
+
+class SliceFile:
+    """落盘写入: 预分配目标文件, 切片到达后按偏移量直接写入, 内存占用不随文件大小增长"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.lock = threading.Lock()  # 不支持 os.pwrite 的平台需要 seek + write 加锁
+
+    def open(self, file_size):
+        dir_name = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        if os.path.exists(self.path) and os.stat(self.path).st_nlink > 1:
+            os.remove(self.path)  # 硬链接到内容存储的只读文件不能原地覆盖
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+        os.ftruncate(self.fd, file_size)
+
+    def write(self, offset, content):
+        view = memoryview(content)
+        if hasattr(os, "pwrite"):
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            with self.lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                while view:
+                    view = view[os.write(self.fd, view):]
+
+    def read(self, offset, size):
+        if hasattr(os, "pread"):
+            return os.pread(self.fd, size, offset)
+        with self.lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            return os.read(self.fd, size)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SliceManifest:
+    """
+    断点续传清单: 与目标文件同目录的 .manifest 文件, 记录文件大小、块大小、ETag/Last-Modified 以及已完成块的位图
+    每提交 flush_slices 个切片或距上次刷新超过 flush_interval 秒时原子地刷新一次, 下载结束时再刷新一次;
+    进程中途被杀后重启只需下载缺失的切片(最后一次刷新后完成的切片会重新下载)
+    """
+
+    def __init__(self, path, flush_slices=64, flush_interval=1):
+        self.path = path
+        self.flush_slices = flush_slices
+        self.flush_interval = flush_interval
+        self.info = {}
+        self.bitmap = bytearray()
+        self.dirty = 0  # 上次刷新后新完成的切片数
+        self.version = 0  # 每次修改加一, 避免较旧的快照覆盖较新的清单
+        self.dumped_version = 0
+        self.last_dump = time.monotonic()
+        self.lock = threading.Lock()
+        self.dump_lock = threading.Lock()  # 写文件不占用 self.lock, 刷新时其他线程仍可提交切片
+
+    def load(self, file_size, block_size, etag=None, last_modified=None):
+        """加载历史清单, 文件大小/块大小/ETag/Last-Modified 任一不一致时视为失效"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            bitmap = bytearray.fromhex(info.pop("bitmap"))
+        except Exception as e:
+            logger.warning(f"【{self.path}】断点续传清单损坏:{e}")
+            return False
+        if info.get("file_size") != file_size or info.get("block_size") != block_size:
+            return False
+        if etag or info.get("etag"):
+            if info.get("etag") != etag:
+                return False
+        elif info.get("last_modified") != last_modified:
+            return False
+        self.info = info
+        self.bitmap = bitmap
+        return True
+
+    def reset(self, file_size, block_size, block_count, etag=None, last_modified=None):
+        self.info = {
+            "file_size": file_size,
+            "block_size": block_size,
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+        self.bitmap = bytearray((block_count + 7) // 8)
+        self.version += 1
+        self.flush()
+
+    def flush(self):
+        """把未刷新的修改写入清单文件, 没有修改时不写"""
+        with self.lock:
+            if self.version == self.dumped_version:
+                return
+            version = self.version
+            content = json.dumps(dict(self.info, bitmap=self.bitmap.hex()))
+            self.dirty = 0
+            self.last_dump = time.monotonic()
+        with self.dump_lock:
+            if version <= self.dumped_version:
+                return
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, self.path)
+            self.dumped_version = version
+
+    def is_done(self, index):
+        return bool(self.bitmap[index >> 3] & (1 << (index & 7)))
+
+    def done_count(self):
+        return sum(bin(byte).count("1") for byte in self.bitmap)
+
+    def mark(self, index, count=1, checksum=None):
+        with self.lock:
+            for i in range(index, index + count):
+                self.bitmap[i >> 3] |= 1 << (i & 7)
+            if checksum:
+                self.info.setdefault("checksums", {})[str(index)] = [count, checksum]
+            self.version += 1
+            self.dirty += 1
+            due = self.dirty >= self.flush_slices or time.monotonic() - self.last_dump >= self.flush_interval
+        if due:
+            self.flush()
+
+    def unmark(self, index, count=1):
+        """撤销以 index 块开始的切片的完成记录, 用于读回校验失败后重新下载"""
+        with self.lock:
+            for i in range(index, index + count):
+                self.bitmap[i >> 3] &= ~(1 << (i & 7))
+            self.info.get("checksums", {}).pop(str(index), None)
+            self.version += 1
+            self.dirty += 1
+
+    def checksum(self, index):
+        """返回以 index 块开始的切片的 (块数, 校验和), 没有记录时返回 (None, None)"""
+        return tuple(self.info.get("checksums", {}).get(str(index), (None, None)))
+
+    def remove(self):
+        with self.dump_lock:
+            self.dumped_version = self.version  # 之后的 flush 不再重新生成清单
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class SliceScheduler:
+    """
+    切片调度器: 把文件按 block_size 划分为块, 每次从剩余区间头部切出若干整块作为切片任务
+    切片任务的 index 为起始块号, 与 success_list/断点续传位图一一对应
+    开启自适应(adaptive)后根据实测耗时与吞吐调整切片大小与并发数:
+        并发数 AIMD: 切片成功时加性增长(每轮 +1), 失败时乘性减半; 窗口吞吐不再随并发增长时回退到最佳并发
+        切片大小: 单个切片耗时远小于 target_time 时翻倍(摊薄请求开销), 远大于或失败时减半
+    """
+
+    def __init__(self, file_size, block_size, slice_size, semaphore, adaptive=False, slice_size_range=None,
+                 semaphore_range=None, target_time=2, is_done=None):
+        """
+        :param file_size: 文件大小
+        :param block_size: 块大小, 切片大小总是块大小的整数倍
+        :param slice_size: 初始切片大小
+        :param semaphore: 初始并发数
+        :param adaptive: 是否自适应调整切片大小与并发数
+        :param slice_size_range: 自适应切片大小上下限 (min, max)
+        :param semaphore_range: 自适应并发数上下限 (min, max)
+        :param target_time: 自适应期望的单个切片耗时(秒)
+        :param is_done: 判断块是否已完成的函数(断点续传)
+        """
+        self.file_size = file_size
+        self.block_size = block_size
+        self.block_count = (file_size + block_size - 1) // block_size
+        self.adaptive = adaptive
+        self.target_time = target_time
+        self.slice_blocks_range = (1, self.block_count)
+        self.semaphore_range = (semaphore, semaphore)
+        if adaptive:
+            if slice_size_range:
+                self.slice_blocks_range = (max(1, slice_size_range[0] // block_size),
+                                           max(1, slice_size_range[1] // block_size))
+            self.semaphore_range = semaphore_range or (1, max(semaphore, 1) * 2)
+        self.slice_blocks = self.clamp(max(1, slice_size // block_size), self.slice_blocks_range)
+        self.concurrency = float(self.clamp(semaphore, self.semaphore_range))
+        self.pending = deque()  # 待下载的块区间 [start, end)
+        self.retry_tasks = deque()  # 失败后重新排队的切片任务
+        start = None
+        for block in range(self.block_count):
+            if is_done and is_done(block):
+                if start is not None:
+                    self.pending.append([start, block])
+                    start = None
+            elif start is None:
+                start = block
+        if start is not None:
+            self.pending.append([start, self.block_count])
+        self.lock = threading.Lock()
+        self.last_decrease = 0
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.best_speed = 0
+        self.best_concurrency = self.concurrency
+
+    @staticmethod
+    def clamp(value, value_range):
+        return max(value_range[0], min(value_range[1], value))
+
+    def has_task(self):
+        return bool(self.pending or self.retry_tasks)
+
+    def limit(self):
+        """当前允许的在途切片数"""
+        return int(self.concurrency)
+
+    def next_task(self):
+        with self.lock:
+            if self.retry_tasks:
+                return self.retry_tasks.popleft()
+            run = self.pending[0]
+            start_block = run[0]
+            end_block = min(run[1], start_block + self.slice_blocks)
+            if end_block == run[1]:
+                self.pending.popleft()
+            else:
+                run[0] = end_block
+        start = start_block * self.block_size
+        end = min(end_block * self.block_size, self.file_size) - 1
+        return start_block, end - start + 1, {"Range": "bytes={0}-{1}".format(start, end)}
+
+    def requeue(self, slice_tasks):
+        with self.lock:
+            self.retry_tasks.extend(slice_tasks)
+
+    def on_success(self, size, elapsed):
+        if not self.adaptive:
+            return
+        with self.lock:
+            self.concurrency = min(self.semaphore_range[1], self.concurrency + 1 / self.concurrency)
+            if elapsed < self.target_time / 2:
+                self.slice_blocks = min(self.slice_blocks_range[1], self.slice_blocks * 2)
+            elif elapsed > self.target_time * 2:
+                self.slice_blocks = max(self.slice_blocks_range[0], self.slice_blocks // 2)
+            now = time.monotonic()
+            self.window_bytes += size
+            if now - self.window_start >= self.target_time:
+                speed = self.window_bytes / (now - self.window_start)
+                if speed > self.best_speed:
+                    self.best_speed, self.best_concurrency = speed, self.concurrency
+                elif speed < self.best_speed * 0.9 and self.concurrency > self.best_concurrency:
+                    self.concurrency = self.best_concurrency  # 并发增加但吞吐没有提升, 回退到最佳并发
+                self.best_speed *= 0.95  # 最佳吞吐缓慢衰减, 适应网络变化
+                self.window_start, self.window_bytes = now, 0
+
+    def on_failure(self):
+        if not self.adaptive:
+            return
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_decrease < self.target_time:
+                return  # 同一时间窗口内的连续失败只减一次
+            self.last_decrease = now
+            self.concurrency = max(self.semaphore_range[0], self.concurrency / 2)
+            self.slice_blocks = max(self.slice_blocks_range[0], self.slice_blocks // 2)
+
+    def stats(self):
+        return {
+            "concurrency": self.limit(),
+            "slice_size": self.slice_blocks * self.block_size,
+            "best_speed": round(self.best_speed / (1024 * 1024), 2),
+        }
+
+
+class AesDecryptTransform:
+    """
+    AES 流式解密, 即 crypto.AesCipher 的 decryptor(): CBC/ECB 保留最后一个块到结束时去填充, CTR 可解密任意长度;
+    iv 为空时为 ECB, CTR 模式的 iv 为完整的 16 字节初始计数块, key/iv 解码方式与 crypto.py 相同
+    """
+
+    def __init__(self, key, iv="", mode="CBC", decode=None, padding=True):
+        if crypto is None:
+            raise ImportError("AesDecryptTransform 需要安装 pycryptodome")
+        self.stream = crypto.AesCipher(key, iv, mode if iv else "ECB", decode, padding=padding).decryptor()
+
+    def update(self, data):
+        return self.stream.update(data)
+
+    def finish(self):
+        return self.stream.finish()
+
+
+class GzipDecompressTransform:
+    """gzip/zlib 流式解压, 自动识别头部, 支持多个 gzip 成员拼接"""
+
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+
+    def update(self, data):
+        output = [self.decompressor.decompress(data)]
+        while self.decompressor.eof and self.decompressor.unused_data:
+            data = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+            output.append(self.decompressor.decompress(data))
+        return b"".join(output)
+
+    def finish(self):
+        data = self.decompressor.flush()
+        if not self.decompressor.eof:
+            raise Exception("gzip 数据不完整")
+        return data
+
+
+class ZstdDecompressTransform:
+    """zstd 流式解压(需要 zstandard)"""
+
+    def __init__(self):
+        if zstandard is None:
+            raise ImportError("ZstdDecompressTransform 需要安装 zstandard")
+        self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def update(self, data):
+        return self.decompressor.decompress(data)
+
+    def finish(self):
+        return self.decompressor.flush()
+
+
+class HashTransform:
+    """透传数据并计算哈希, 放在解密/解压之后即得到明文的摘要"""
+
+    def __init__(self, algorithm="sha256"):
+        if not hasattr(hashlib, algorithm):
+            raise Exception(f"未定义hash类型: {algorithm}")
+        self.hash = getattr(hashlib, algorithm)()
+
+    def update(self, data):
+        self.hash.update(data)
+        return data
+
+    def finish(self):
+        return b""
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class TransformPipeline:
+    """
+    流式变换管道: 按文件顺序接收已连续的数据, 依次经过各变换(解密/解压/哈希)后写入 path, 未指定 path 时保存在内存
+    变换对象需实现 update(data) -> bytes 与 finish() -> bytes, 变换对象只能使用一次
+    """
+
+    def __init__(self, transforms, path=None):
+        self.transforms = list(transforms)
+        self.path = path
+        self.file = None
+        self.chunks = []
+        self.size = 0  # 已输出的字节数
+        self.error = None
+
+    def write(self, data):
+        if self.path:
+            if self.file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self.file = open(self.path, "wb")
+            self.file.write(data)
+        else:
+            self.chunks.append(data)
+        self.size += len(data)
+
+    def feed(self, data):
+        """变换异常后不再处理后续数据, 在 close 时报告"""
+        if self.error:
+            return
+        try:
+            for transform in self.transforms:
+                data = transform.update(data)
+                if not data:
+                    return
+            self.write(data)
+        except Exception as e:
+            self.error = f"数据变换异常:{e}"
+
+    def close(self):
+        """
+        结束各变换(前一个变换的尾部数据继续经过后面的变换)
+        :return: (ok, 输出路径或内容/错误描述)
+        """
+        if not self.error:
+            try:
+                for i, transform in enumerate(self.transforms):
+                    data = transform.finish()
+                    for following in self.transforms[i + 1:]:
+                        if not data:
+                            break
+                        data = following.update(data)
+                    if data:
+                        self.write(data)
+            except Exception as e:
+                self.error = f"数据变换异常:{e}"
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.error:
+            self.abort()
+            return False, self.error
+        if self.path:
+            if not os.path.exists(self.path):
+                open(self.path, "wb").close()
+            return True, self.path
+        return True, b"".join(self.chunks)
+
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.chunks = []
+
+
+class SliceVerifier:
+    """
+    下载过程中的增量校验:
+        每个切片到达时计算校验和(安装 xxhash 时为 xxh64, 否则为 crc32), 乱序切片从文件读回时据此校验,
+        校验和不一致的区间记入 corrupted 并停在该处, 由下载器重新下载后再继续
+        已连续完成的前缀按文件顺序喂给整文件哈希(md5/sha256 等 hashlib 名称, 与 crypto.myhash 一致),
+        下载结束即得到整文件摘要, 无需再完整读一遍; 同时可按顺序交给 consumer(如 TransformPipeline.feed)
+    """
+
+    def __init__(self, algorithm="md5", expected=None, read=None, consumer=None):
+        """
+        :param algorithm: 整文件哈希算法, 为 None 时不计算整文件哈希
+        :param expected: 期望的整文件摘要(hex), 为 None 时只计算不比对
+        :param read: 落盘模式读回文件区间的函数 read(offset, size), 为 None 时乱序切片保留在内存中
+        :param consumer: 按文件顺序接收已连续数据的函数 consumer(content)
+        """
+        if algorithm and not hasattr(hashlib, algorithm):
+            raise Exception(f"未定义hash类型: {algorithm}")
+        self.algorithm = algorithm
+        self.hash = getattr(hashlib, algorithm)() if algorithm else None
+        self.consumer = consumer
+        self.expected = expected.lower() if expected else None
+        self.read = read
+        self.offset = 0  # 已计入整文件哈希的前缀长度
+        self.pending = {}  # offset -> (size, content, checksum), 落盘模式 content 为 None
+        self.corrupted = {}  # offset -> size, 读回后校验和不一致、等待重新下载的区间
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def checksum(content):
+        if xxhash:
+            return xxhash.xxh64_hexdigest(content)
+        return "%08x" % zlib.crc32(content)
+
+    def add(self, offset, size, content=None, checksum=None):
+        """登记已完成的区间并推进整文件哈希; 落盘模式下乱序区间不保留内容, 轮到时从文件读回并用 checksum 校验"""
+        with self.lock:
+            if self.read and offset != self.offset:
+                content = None
+            self.pending[offset] = (size, content, checksum)
+            self.corrupted.pop(offset, None)
+            while self.offset in self.pending:
+                size, content, checksum = self.pending.pop(self.offset)
+                if content is None:
+                    content = self.read(self.offset, size)
+                    if checksum and self.checksum(content) != checksum:
+                        self.corrupted[self.offset] = size
+                        break
+                if self.hash:
+                    self.hash.update(content)
+                if self.consumer:
+                    self.consumer(content)
+                self.offset += size
+
+    def verify(self, file_size):
+        """
+        :return: (ok, 摘要或错误描述)
+        """
+        if self.corrupted:
+            return False, f"偏移{min(self.corrupted)}处切片读回后校验和不一致"
+        if self.offset != file_size:
+            return False, f"整文件哈希只覆盖了{self.offset}/{file_size}字节"
+        if not self.hash:
+            return True, None
+        digest = self.hash.hexdigest()
+        if self.expected and digest != self.expected:
+            return False, f"{self.algorithm}摘要不一致:{digest}!={self.expected}"
+        return True, digest
+
+
+class DownloadEvents:
+    """
+    下载事件与指标, 通过 slice_hooks 传入的回调(或 stream() 异步迭代)接收, 事件为 dict:
+        start: total 文件大小, resumed 断点续传已完成的字节数, 每次下载只发出一次, 与 finish 成对
+        slice: 切片下载成功 index/size/elapsed/source
+        retry: 切片失败即将重试 index/count/error/delay
+        hedge: 尾部切片发起对冲请求 index/elapsed
+        progress: 进度 done/total/cached/throughput(字节/秒), 按 progress_interval 节流
+        finish: 下载结束 state 以及 snapshot() 中的全部计数
+    回调可能在下载线程中调用, 需要自行保证线程安全且不阻塞
+    """
+
+    def __init__(self, url, hooks=None, progress_interval=0.5, window=5):
+        self.url = url
+        if callable(hooks):
+            hooks = [hooks]
+        self.hooks = list(hooks or [])
+        self.progress_interval = progress_interval
+        self.window = window  # 实时吞吐的统计窗口(秒)
+        self.total = 0
+        self.done = 0  # 已完成字节数(含缓存)
+        self.cached = 0  # 来自缓存/断点续传的字节数
+        self.slices = 0
+        self.retries = 0
+        self.hedges = 0
+        self.requests = 0
+        self.started = False  # 是否已发出 start 事件
+        self.start_time = None
+        self.last_progress = 0
+        self.samples = deque()  # (时间, 字节数), 用于计算实时吞吐
+        self.lock = threading.Lock()
+
+    def subscribe(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def unsubscribe(self, hook):
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+
+    def stream(self):
+        """异步迭代下载事件, 需在下载开始前调用, 收到 finish 事件后结束"""
+        return DownloadEventStream(self)
+
+    def emit(self, event, **data):
+        if not self.hooks:
+            return
+        data["event"] = event
+        data["url"] = self.url
+        for hook in list(self.hooks):
+            try:
+                hook(data)
+            except Exception as e:
+                logger.warning("【{}】事件回调异常,已移除:{}", self.url, e)
+                self.unsubscribe(hook)
+
+    def throughput(self, now=None):
+        """最近 window 秒内的下载速度(字节/秒), 不含缓存"""
+        now = now or time.monotonic()
+        with self.lock:
+            while self.samples and now - self.samples[0][0] > self.window:
+                self.samples.popleft()
+            if not self.samples:
+                return 0.0
+            elapsed = max(now - self.samples[0][0], min(self.window, now - self.start_time), 1e-3)
+            return sum(size for _, size in self.samples) / elapsed
+
+    def snapshot(self):
+        return {
+            "total": self.total,
+            "done": self.done,
+            "cached": self.cached,
+            "slices": self.slices,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "requests": self.requests,
+            "throughput": round(self.throughput(), 2),
+            "elapsed": round(time.monotonic() - self.start_time, 4) if self.start_time else 0,
+        }
+
+    def on_start(self, total):
+        """断点续传/缓存的字节计入后调用; 再次调用(整文件探测重试)只更新总大小, 不重复发出 start"""
+        with self.lock:
+            self.total = total
+            if self.started:
+                return
+            self.started = True
+            if self.start_time is None:
+                self.start_time = time.monotonic()
+        self.emit("start", total=total, resumed=self.done)
+
+    def on_reset(self):
+        """整文件响应中断后重新探测: 清零已计入的进度"""
+        with self.lock:
+            self.done = 0
+            self.cached = 0
+            self.samples.clear()
+
+    def on_bytes(self, size, cached=False):
+        now = time.monotonic()
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = now
+            self.done += size
+            if cached:
+                self.cached += size
+            else:
+                self.samples.append((now, size))
+            if not self.hooks or not self.started or \
+                    (now - self.last_progress < self.progress_interval and self.done < self.total):
+                return
+            self.last_progress = now
+        self.emit("progress", done=self.done, total=self.total, cached=self.cached, throughput=self.throughput(now))
+
+    def on_discard(self, size, cached=False):
+        """已计入进度的字节作废(如读回校验失败需重新下载)时扣除"""
+        with self.lock:
+            self.done -= size
+            if cached:
+                self.cached -= size
+
+    def on_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def on_slice(self, index, size, elapsed, source=None):
+        with self.lock:
+            self.slices += 1
+        self.emit("slice", index=index, size=size, elapsed=elapsed, source=source.url if source else self.url)
+
+    def on_retry(self, index, count, error, delay):
+        with self.lock:
+            self.retries += 1
+        self.emit("retry", index=index, count=count, error=error, delay=delay)
+
+    def on_hedge(self, index, elapsed):
+        with self.lock:
+            self.hedges += 1
+        self.emit("hedge", index=index, elapsed=elapsed)
+
+    def on_finish(self, state):
+        if not self.started:
+            self.on_start(self.total)  # 探测失败等未开始下载的情况也补发 start, 保证 start/finish 成对
+        snapshot = self.snapshot()
+        logger.debug("【{}】下载统计:{}", self.url, snapshot)
+        self.emit("finish", state=state, **snapshot)
+
+
+class DownloadEventStream:
+    """
+    异步迭代下载事件, 线程模式下的事件通过 call_soon_threadsafe 转交事件循环:
+        stream = downloader.events.stream()
+        task = asyncio.create_task(downloader.download())
+        async for event in stream:
+            ...
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.finished = False
+        events.subscribe(self.put)
+
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.finished:
+            raise StopAsyncIteration
+        event = await self.queue.get()
+        if event["event"] == "finish":
+            self.finished = True
+            self.events.unsubscribe(self.put)
+        return event
+
+
+class PrometheusExporter:
+    """
+    Prometheus 文本格式的下载指标, 作为事件回调汇总多个下载:
+        exporter = PrometheusExporter()
+        exporter.serve(9100)  # 可选: 在 /metrics 暴露
+        AsyncSliceDownload(url, "GET", slice_hooks=[exporter])
+    """
+
+    buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, prefix="slice_download"):
+        self.prefix = prefix
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}
+        self.histogram = [0] * (len(self.buckets) + 1)  # 切片耗时分布, 最后一个为 +Inf
+        self.histogram_sum = 0.0
+        self.server = None
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def __call__(self, event):
+        with self.lock:
+            kind = event["event"]
+            if kind == "start":
+                self.gauges["active_downloads"] = self.gauges.get("active_downloads", 0) + 1
+            elif kind == "slice":
+                self.inc("slices_total")
+                self.inc("bytes_total", event["size"], source="network")
+                self.histogram_sum += event["elapsed"]
+                for i, bucket in enumerate(self.buckets):
+                    if event["elapsed"] <= bucket:
+                        self.histogram[i] += 1
+                        break
+                else:
+                    self.histogram[-1] += 1
+            elif kind == "retry":
+                self.inc("retries_total")
+            elif kind == "hedge":
+                self.inc("hedges_total")
+            elif kind == "progress":
+                self.gauges["throughput_bytes"] = event["throughput"]
+            elif kind == "finish":
+                self.gauges["active_downloads"] = max(0, self.gauges.get("active_downloads", 0) - 1)
+                self.inc("downloads_total", state=event["state"])
+                self.inc("requests_total", event["requests"])
+                self.inc("bytes_total", event["cached"], source="cache")
+
+    def render(self):
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {self.prefix}_{name} counter")
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{self.prefix}_{name}{{{label_text}}} {value}" if label_text else
+                             f"{self.prefix}_{name} {value}")
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE {self.prefix}_{name} gauge")
+                lines.append(f"{self.prefix}_{name} {value}")
+            name = f"{self.prefix}_slice_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            count = 0
+            for bucket, value in zip(self.buckets + ("+Inf",), self.histogram):
+                count += value
+                lines.append(f'{name}_bucket{{le="{bucket}"}} {count}')
+            lines.append(f"{name}_sum {round(self.histogram_sum, 6)}")
+            lines.append(f"{name}_count {count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9100, host="0.0.0.0"):
+        """在后台线程中通过 http://host:port/metrics 暴露指标"""
+        exporter = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                body = exporter.render().encode()
+                self.send_response(200 if self.path.startswith("/metrics") else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+
+class TqdmProgress:
+    """
+    tqdm 进度条, 作为事件回调使用: AsyncSliceDownload(url, "GET", slice_hooks=[TqdmProgress()])
+    """
+
+    def __init__(self, bar_factory=None, **tqdm_kwargs):
+        if bar_factory is None and tqdm is None:
+            raise ImportError("TqdmProgress 需要安装 tqdm")
+        self.bar_factory = bar_factory or tqdm
+        self.tqdm_kwargs = tqdm_kwargs
+        self.bar = None
+
+    def __call__(self, event):
+        kind = event["event"]
+        if kind == "start":
+            kwargs = {"total": event["total"], "initial": event["resumed"], "unit": "B", "unit_scale": True,
+                      "unit_divisor": 1024, "desc": event["url"][-30:]}
+            kwargs.update(self.tqdm_kwargs)
+            self.bar = self.bar_factory(**kwargs)
+        elif kind in ("progress", "finish") and self.bar is not None:
+            self.bar.update(event["done"] - self.bar.n)
+            if kind == "finish":
+                self.bar.close()
+                self.bar = None
+
+
+class FileMeta:
+    """探测得到的文件元数据"""
+
+    def __init__(self, size=None, etag=None, last_modified=None, accept_ranges=False, digests=None):
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.accept_ranges = accept_ranges
+        self.digests = digests or {}
+        self.time = time.monotonic()
+
+    def __repr__(self):
+        return f"FileMeta(size={self.size}, etag={self.etag}, accept_ranges={self.accept_ranges})"
+
+
+class MetaCache:
+    """
+    文件元数据缓存: 按 (method, url, 请求体) 缓存文件大小、ETag、是否支持 Range,
+    ttl 秒内重复下载同一文件时不再发送探测请求; 过期条目保留, 用于决定是否用 HEAD 低成本复核
+    """
+
+    def __init__(self, ttl=300, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.items = {}  # key -> FileMeta, 按写入顺序淘汰
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        """传给 worker 进程时复制当前条目, 锁在进程内重建"""
+        with self.lock:
+            return {"ttl": self.ttl, "max_size": self.max_size, "items": dict(self.items)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(method, url, data=None):
+        if data is None:
+            return f"{method.upper()} {url}"
+        if not isinstance(data, (bytes, str)):
+            data = json.dumps(data, sort_keys=True, default=str)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return f"{method.upper()} {url} {hashlib.md5(data).hexdigest()}"
+
+    def get(self, key):
+        """
+        :return: (meta, fresh) 没有缓存时 meta 为 None
+        """
+        with self.lock:
+            meta = self.items.get(key)
+        if meta is None:
+            return None, False
+        return meta, time.monotonic() - meta.time < self.ttl
+
+    def set(self, key, meta):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = meta
+            while len(self.items) > self.max_size:
+                self.items.pop(next(iter(self.items)))
+
+    def evict(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+
+meta_cache = MetaCache()  # 进程内共享的元数据缓存, 需通过 meta_cache 参数显式传入才会启用
+
+
+VOLATILE_QUERY_PARAMS = {
+    "signature", "sig", "sign", "expires", "expire", "policy", "key-pair-id", "token", "security-token",
+    "auth_key", "ossaccesskeyid", "x-amz-algorithm", "x-amz-credential", "x-amz-date", "x-amz-expires",
+    "x-amz-security-token", "x-amz-signature", "x-amz-signedheaders", "_",
+}  # 签名/过期时间等易变参数, 仅在确认这些参数不标识资源时通过 strip_volatile_params 去掉
+
+
+def normalize_url(url, strip_params=None):
+    """
+    内容存储 url 键的归一化方法, 默认原样返回: token/sign 等参数经常就是资源标识, 不能默认去掉
+    :param strip_params: 需要去掉的参数名(小写)集合, 传入时同时排序其余参数、去掉 fragment
+    """
+    if not strip_params:
+        return url
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k.lower() not in strip_params)
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+
+def strip_volatile_params(url):
+    """可选的 url_normalizer: 去掉 VOLATILE_QUERY_PARAMS 中的签名/过期参数, 同一附件的不同签名链接归一为同一个 url"""
+    return normalize_url(url, VOLATILE_QUERY_PARAMS)
+
+
+class FileLock:
+    """跨进程文件锁: posix 使用 fcntl.flock, windows 使用 msvcrt.locking"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.lock = threading.Lock()  # flock 对同一进程内的多个线程不互斥
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(self.fd, msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if fcntl:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+            self.lock.release()
+
+
+class ContentStore:
+    """
+    内容寻址的本地文件存储: 下载完成的文件按内容哈希保存一份, 以下列键建立索引:
+        digest:算法:hex  调用方传入 slice_digest 时无需任何网络请求即可命中
+        url:归一化 url:大小:ETag  探测后大小与 ETag 均一致才命中(url_normalizer 默认不改写 url)
+        etag:host:大小:ETag   仅 store_etag_key 开启且为强 ETag 时使用, 同一 host 下大小与 ETag 相同即视为同一文件
+    命中后落盘模式依次尝试 reflink、硬链接(对象文件只读, 链接出的文件同样只读)、复制到 save_path, 内存模式通过 mmap 读取
+    索引为 root/index.json, 读改写在跨进程文件锁内完成, 多个 worker 进程可共享同一个存储
+    总大小超过 max_size 时按最近访问时间(LRU)淘汰
+    """
+
+    def __init__(self, root="cache_store", max_size=10 * 1024 * 1024 * 1024, link=("reflink", "hardlink", "copy")):
+        """
+        :param root: 存储目录
+        :param max_size: 存储总大小上限(字节)
+        :param link: 命中时生成 save_path 的方式及优先级
+        """
+        self.root = root
+        self.max_size = max_size
+        self.link = link
+        self.index_path = os.path.join(root, "index.json")
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self.file_lock = FileLock(os.path.join(root, "index.lock"))
+        self.hits = 0
+        self.misses = 0
+
+    def load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"objects": {}, "keys": {}}
+
+    def dump_index(self, index):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def object_path(self, digest):
+        algorithm, value = digest.split(":", 1)
+        return os.path.join(self.root, "objects", algorithm, value[:2], value)
+
+    def lookup(self, keys, size=None):
+        """
+        :param keys: 依次尝试的索引键
+        :param size: 已知文件大小时校验大小是否一致
+        :return: (对象路径, 对象信息), 未命中返回 None
+        """
+        with self.file_lock:
+            index = self.load_index()
+            for key in keys:
+                digest = index["keys"].get(key)
+                info = index["objects"].get(digest) if digest else None
+                if info is None or (size is not None and info["size"] != size):
+                    continue
+                path = self.object_path(digest)
+                if not os.path.exists(path) or os.path.getsize(path) != info["size"]:
+                    self.drop(index, digest)
+                    self.dump_index(index)
+                    continue
+                info["atime"] = time.time()
+                self.dump_index(index)
+                self.hits += 1
+                return path, dict(info, digest=digest)
+        self.misses += 1
+        return None
+
+    def put(self, digest, keys, source_path=None, content=None):
+        """
+        保存下载完成的文件并建立索引
+        :param digest: "算法:hex"
+        :param source_path: 落盘模式的文件路径(reflink 或复制, 不做硬链接, 避免调用方修改文件后污染存储)
+        :param content: 内存模式的文件内容
+        """
+        path = self.object_path(digest)
+        size = os.path.getsize(source_path) if source_path else len(content)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            if source_path:
+                self.materialize(source_path, tmp_path, ("reflink", "copy"))
+            else:
+                with open(tmp_path, "wb") as f:
+                    f.write(content)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, path)
+        with self.file_lock:
+            index = self.load_index()
+            index["objects"][digest] = {"size": size, "atime": time.time()}
+            for key in keys:
+                index["keys"][key] = digest
+            self.evict(index)
+            self.dump_index(index)
+        return path
+
+    def drop(self, index, digest):
+        index["objects"].pop(digest, None)
+        for key in [k for k, v in index["keys"].items() if v == digest]:
+            index["keys"].pop(key)
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            os.chmod(path, 0o644)
+            os.remove(path)
+
+    def evict(self, index):
+        """按最近访问时间淘汰, 直到总大小不超过 max_size"""
+        total = sum(info["size"] for info in index["objects"].values())
+        for digest, info in sorted(index["objects"].items(), key=lambda item: item[1]["atime"]):
+            if total <= self.max_size:
+                break
+            self.drop(index, digest)
+            total -= info["size"]
+            logger.debug("内容存储淘汰:{}", digest)
+
+    @staticmethod
+    def reflink(source, target):
+        """linux 下通过 FICLONE 共享数据块(btrfs/xfs 等), 不支持时抛出 OSError"""
+        if not fcntl or not sys.platform.startswith("linux"):
+            raise OSError("reflink 仅支持 linux")
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), 0x40049409, src.fileno())  # FICLONE
+            except OSError:
+                dst.close()
+                os.remove(target)
+                raise
+
+    def materialize(self, source, target, link=None):
+        """按 link 的优先级生成 target, 返回实际使用的方式"""
+        os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(target)
+        for mode in link or self.link:
+            try:
+                if mode == "reflink":
+                    self.reflink(source, target)
+                elif mode == "hardlink":
+                    os.link(source, target)
+                else:
+                    shutil.copyfile(source, target)
+                return mode
+            except OSError:
+                continue
+        raise OSError(f"无法从内容存储生成文件:{target}")
+
+    @staticmethod
+    def read(path):
+        with open(path, "rb") as f:
+            if not os.fstat(f.fileno()).st_size:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+
+    def stats(self):
+        with self.file_lock:
+            index = self.load_index()
+        return {
+            "objects": len(index["objects"]),
+            "size": sum(info["size"] for info in index["objects"].values()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
 
 
 class SliceDownloadBase:
@@ -37,6 +1799,9 @@ class SliceDownloadBase:
         }
         self.data = data
         self.is_proxy = True if request_kwargs.get("is_proxy") else False
+        self.proxy_pool = request_kwargs.get("proxy_pool")  # 代理池 ProxyPool, 可在多次下载间共享
+        if self.is_proxy and self.proxy_pool is None:
+            self.proxy_pool = ProxyPool(fetch=self.get_proxy)
         self.slice_size = request_kwargs.get("slice_size", 2 * 1024 * 1024)  # 自定义或默认分片大小为2M
         self.slice_min_size = request_kwargs.get("slice_min_size", 2 * 1024 * 1024)  # 小于slice_min_size的切片不再分片
         self.slice_semaphore = request_kwargs.get("slice_semaphore", 20)  # 自定义或默认分片并发数为10
@@ -44,13 +1809,89 @@ class SliceDownloadBase:
         self.slice_timeout = request_kwargs.get("slice_timeout") or 30  # 自定义或默认分片超时时间为30s
         self.slice_retry_times = request_kwargs.get("slice_retry_times", 10)  # 自定义或默认分片重试次数为10
         self.err_list_retry_times = request_kwargs.get("err_list_retry_times", 1)  # 自定义或默认失败列表重试次数为1
+        self.retry_policy = request_kwargs.get("retry_policy") or RetryPolicy.from_kwargs(request_kwargs)
+        self.slice_adaptive = request_kwargs.get("slice_adaptive", False)  # 是否根据实测吞吐自适应切片大小与并发数
+        self.slice_size_range = request_kwargs.get("slice_size_range",
+                                                   (512 * 1024, 32 * 1024 * 1024))  # 自适应切片大小上下限
+        self.slice_semaphore_range = request_kwargs.get("slice_semaphore_range",
+                                                        (2, self.slice_semaphore * 2))  # 自适应并发数上下限
+        self.slice_target_time = request_kwargs.get("slice_target_time", 2)  # 自适应期望的单个切片耗时(秒)
+        self.scheduler = None
+        self.slice_verify = request_kwargs.get("slice_verify")  # 增量校验的整文件哈希算法(md5/sha256...), True 为 md5
+        self.slice_digest = request_kwargs.get("slice_digest")  # 期望的整文件摘要 hex 或 "算法:hex"
+        self.response_digests = {}  # 响应头中的整文件摘要 {算法: hex}
+        self.verifier = None
+        self.digest = None  # 校验通过后的整文件摘要
+        self.slice_transforms = request_kwargs.get("slice_transforms")  # 流式变换(解密/解压/哈希)列表或返回列表的函数
+        self.transform_path = request_kwargs.get("transform_path")  # 变换结果保存路径, 为 None 时返回 bytes
+        self.pipeline = None
+        self.slice_hedge = request_kwargs.get("slice_hedge", True)  # 是否对尾部拖慢的切片发起对冲请求
+        self.slice_hedge_factor = request_kwargs.get("slice_hedge_factor", 3)  # 耗时超过中位数的倍数视为拖慢
+        self.slice_hedge_ratio = request_kwargs.get("slice_hedge_ratio", 0.9)  # 已完成数据占比达到该值后才开始对冲
+        self.slice_times = []  # 已完成切片耗时, 用于计算中位数
+        self.committed = {}  # index -> 最先完成的切片任务, 同一切片只提交一次
+        self.settled = set()  # 已处理完对冲结果的切片 index
+        self.hedged = {}  # index -> (原请求开始时间, 对冲切片任务)
+        self.hedge_stats = {"fired": 0, "won": 0, "saved_max": 0.0}
+        self.finished = False  # 下载已结束, 仍在运行的对冲落败线程不再重试
+        self.url_normalizer = request_kwargs.get("url_normalizer") or normalize_url  # 内容存储 url 键的归一化方法
+        # 内容存储是否按 host+大小+ETag 跨 url 命中: 只适用于 ETag 为内容哈希的站点, 弱 ETag 从不使用
+        self.store_etag_key = request_kwargs.get("store_etag_key", False)
         self.unique_id = myhash(url)  # 根据url生成md5唯一id
         self.err_list = []  # 存储错误切片任务进行重试
         self.success_list = []  # 存储成功切片任务
         self.cache_dict = {}  # 存储加载的缓存切片
         self.rw_semaphore = None  # 读写文件并发数 异步信号量与 asyncio.run 连用时,需要在异步函数中设置
+        self.save_path = request_kwargs.get("save_path")  # 落盘模式: 切片直接写入该文件, download() 返回文件路径
+        self.slice_file = SliceFile(self.save_path) if self.save_path else None
+        self.manifest = None  # 落盘模式开启 slice_cache 时使用清单断点续传
+        self.etag = None
+        self.last_modified = None
+        self.done_size = 0  # 已完成的字节数
+        self.lock = threading.Lock()
+        self.events = DownloadEvents(url, request_kwargs.get("slice_hooks"),
+                                     request_kwargs.get("slice_progress_interval", 0.5))  # 进度/指标事件
+        self.source_pool = None  # 多源下载: 主 url 与 sources 中的镜像 url/代理出口
+        if request_kwargs.get("sources"):
+            sources = [SliceSource(url)]
+            for source in request_kwargs["sources"]:
+                if isinstance(source, dict):
+                    sources.append(SliceSource(source.get("url") or url, source.get("proxy", "")))
+                else:
+                    sources.append(SliceSource(source))
+            self.source_pool = SourcePool(sources)
+        self.file_size = None
+        # 文件元数据缓存 MetaCache, 默认不缓存: ttl 内服务端文件变化时会按过期元数据切片, 下载失败后才清除
+        self.meta_cache = request_kwargs.get("meta_cache")
+        self.meta_key = MetaCache.key(method, url, data)
+        self.content_store = request_kwargs.get("content_store")  # 内容寻址存储 ContentStore, 命中时不再下载
+        self.slice_range = request_kwargs.get("slice_range")  # 多进程下载大文件时只下载 [start, end) 区间
+        self.file_meta = request_kwargs.get("file_meta")  # 已知的文件元数据 FileMeta, 传入时不再探测
+        self.bandwidth_limiter = request_kwargs.get("bandwidth_limiter")  # 全局/单 host 带宽整形 BandwidthLimiter
+        self.rate_bucket = TokenBucket(request_kwargs.get("slice_rate_limit", 0))  # 本次下载的限速(字节/秒)
+        self.throttle_chunk_size = 64 * 1024  # 限速时按块读取响应体
+        self.slice_probe = request_kwargs.get("slice_probe", "auto")  # 探测方式 auto/range/head
+        self.slice_probe_size = request_kwargs.get("slice_probe_size") or self.slice_size  # Range 探测取回的字节数
+        self.probe_content = None  # Range 探测取回的文件开头, 作为第一个切片提交
+        self.whole_file = False  # 服务端不支持 Range, 整个文件已随探测响应流式写入
+        self.whole_chunks = []
+        self.whole_size = 0
+        self.whole_length = None
+        self.slice_budget = request_kwargs.get("slice_budget")  # 批量下载时多个下载共享的连接预算 ConnectionBudget
+        self.slice_priority = request_kwargs.get("slice_priority", 0)  # 共享预算时的优先级, 越小越优先
+        self.client_pool = request_kwargs.get("client_pool")  # 外部传入的连接池可在多次下载间复用
+        self.own_client_pool = self.client_pool is None  # 自建的连接池在下载结束后关闭
+        if self.own_client_pool:
+            # 自适应并发可升到 slice_semaphore_range 上限, 连接池按上限建, 否则多出的请求在连接池排队, 被误计为切片耗时
+            self.client_pool = ClientPool(max_connections=self.max_concurrency())
+
+    def max_concurrency(self):
+        """单个下载可能达到的最大在途切片数"""
+        if self.slice_adaptive:
+            return max(self.slice_semaphore, self.slice_semaphore_range[1])
+        return self.slice_semaphore
 
-    # TODO 替换获取代理方法
+    # TODO 替换获取代理方法(未传入 proxy_pool 时作为代理池获取新代理的方法)
     @staticmethod
     def get_proxy():
         # ip = get_proxy()
@@ -98,6 +1939,9 @@ class SliceDownloadBase:
         #     logger.info(f"【{self.url}】没有历史缓存文件需要加载!")
 
     async def save_cache(self):
+        if self.slice_file:
+            return  # 落盘模式下切片已写入目标文件, 不再另存 .part
+        self.rw_semaphore = asyncio.Semaphore(10)
         if not os.path.exists(f"cache_down/{self.unique_id}"):
             os.mkdir(f"cache_down/{self.unique_id}")
         save_cache_tasks = []
@@ -111,165 +1955,927 @@ class SliceDownloadBase:
         if self.check_is_cached():
             shutil.rmtree(f"cache_down/{self.unique_id}")
 
+    def block_size(self, file_size):
+        """切片/断点续传位图的最小单位: 不切片时为整个文件, 自适应时为切片大小下限"""
+        if file_size <= self.slice_min_size:
+            return file_size
+        if self.slice_adaptive:
+            return self.slice_size_range[0]
+        return self.slice_size
+
+    def range_size(self, file_size):
+        """本次需要下载的字节数: 区间模式下为区间长度"""
+        if not self.slice_range:
+            return file_size
+        return min(self.slice_range[1], file_size) - self.slice_range[0]
+
     def calc_slice_task(self, file_size):
-        slice_list = []
+        """生成切片调度器, 断点续传时跳过已完成的块, 区间模式下区间外的块视为已完成"""
+        self.file_size = file_size
+        block_size = self.block_size(file_size)
+        is_done = self.manifest.is_done if self.manifest else None
+        if self.slice_range:
+            first_block = self.slice_range[0] // block_size
+            last_block = (self.slice_range[1] + block_size - 1) // block_size
+
+            def is_done(block):
+                return not first_block <= block < last_block
+        self.scheduler = SliceScheduler(
+            file_size, block_size, self.slice_size, self.slice_semaphore, adaptive=self.slice_adaptive,
+            slice_size_range=self.slice_size_range, semaphore_range=self.slice_semaphore_range,
+            target_time=self.slice_target_time, is_done=is_done)
+        logger.info(f'【{self.url}】获取切片块数:{self.scheduler.block_count}')
+        self.success_list = [b""] * self.scheduler.block_count  # 按块数初始化成功切片列表, 切片存放在起始块位置
+        if self.manifest and self.verifier:
+            self.register_resumed_blocks(block_size, file_size)
+        return self.scheduler
+
+    def register_resumed_blocks(self, block_size, file_size):
+        """断点续传时把已完成的块登记到增量校验器, 轮到时从文件读回, 有校验和记录的切片同时校验"""
         index = 0
-        end = -1
-        while end < file_size - 1:
-            start = end + 1
-            end = start + self.slice_size - 1
-            total_size = end - start + 1
-            if end > file_size:
-                end = file_size
-                total_size = end - start
-            headers = {'Range': 'bytes={0}-{1}'.format(start, end)}
-            slice_list.append((index, total_size, headers))
-            index += 1
-        logger.info(f'【{self.url}】获取切片任务数:{len(slice_list)}')
-        self.success_list = [b""] * len(slice_list)  # 按切片任务数初始化成功切片列表
-        return slice_list
+        while index < self.scheduler.block_count:
+            if not self.manifest.is_done(index):
+                index += 1
+                continue
+            count, checksum = self.manifest.checksum(index)
+            count = count or 1
+            offset = index * block_size
+            self.verifier.add(offset, min(offset + count * block_size, file_size) - offset, checksum=checksum)
+            index += count
+
+    def cached_meta(self):
+        """传入了 file_meta 或元数据缓存未过期时直接使用, 不再发送探测请求"""
+        if self.file_meta:
+            self.apply_meta(self.file_meta)
+            return self.file_meta
+        if not self.meta_cache:
+            return None
+        meta, fresh = self.meta_cache.get(self.meta_key)
+        if not fresh:
+            return None
+        logger.debug("【{}】使用缓存的文件元数据:{}", self.url, meta)
+        self.apply_meta(meta)
+        return meta
+
+    def probe_mode(self):
+        """
+        选择探测方式:
+            head: 只取响应头, 缓存过期且上次支持 Range 的 GET 下载用于低成本复核
+            range: 带上调用方的请求方法与请求体请求文件开头, 同时取回第一个切片
+            whole: 已知不支持 Range, 直接请求整个文件
+        """
+        if self.slice_probe in ("range", "head"):
+            return self.slice_probe
+        meta = self.meta_cache.get(self.meta_key)[0] if self.meta_cache else None
+        if meta is None:
+            return "range"
+        if not meta.accept_ranges:
+            return "whole"
+        return "head" if self.method.upper() == "GET" else "range"
+
+    def probe_headers(self, mode):
+        headers = dict(self.headers)
+        if mode == "range":
+            headers["Range"] = "bytes=0-{}".format(self.slice_probe_size - 1)
+        return headers
+
+    def apply_meta(self, meta):
+        self.etag = meta.etag
+        self.last_modified = meta.last_modified
+        self.response_digests = meta.digests
+        if self.meta_cache:
+            self.meta_cache.set(self.meta_key, meta)
+
+    def accept_probe(self, mode, response):
+        """
+        解析 HEAD/Range 探测响应(200 的整文件响应由 begin_whole_file 处理)
+        :return: 文件大小, HEAD 无法确定是否支持 Range 时返回 None
+        """
+        headers = response.headers
+        if mode == "head":
+            if response.status_code != 200 or headers.get("Accept-Ranges") != "bytes" \
+                    or not headers.get("Content-Length"):
+                return None
+            size = int(headers["Content-Length"])
+        elif response.status_code == 206 and headers.get("Content-Range"):
+            size = int(headers["Content-Range"].split("/")[-1])
+            self.probe_content = response.content
+        else:
+            raise Exception(f"【{self.url}】请求状态码异常:{response.status_code}")
+        self.apply_meta(FileMeta(size, headers.get("ETag"), headers.get("Last-Modified"), True,
+                                 self.parse_digest_headers(headers)))
+        return size
+
+    def begin_whole_file(self, response):
+        """
+        服务端不支持 Range 返回 200: 响应体流式写入目标(落盘模式直接写文件), 边写边增量校验;
+        上次整文件响应中断后重试时先关闭目标文件并丢弃变换管道的输出, 变换对象有状态, 需传入返回新列表的函数才能重新开始
+        """
+        if self.pipeline:
+            self.pipeline.abort()
+            self.pipeline = None
+            if not callable(self.slice_transforms):
+                raise Exception("整文件响应中断, slice_transforms 为变换对象列表时无法重新开始变换")
+        if self.slice_file:
+            self.slice_file.close()
+        length = response.headers.get("Content-Length")
+        self.whole_file = True
+        self.whole_length = int(length) if length else None
+        self.whole_chunks = []
+        self.whole_size = 0
+        with self.lock:
+            self.done_size = 0
+        self.events.on_reset()
+        self.apply_meta(FileMeta(self.whole_length, response.headers.get("ETag"),
+                                 response.headers.get("Last-Modified"), False,
+                                 self.parse_digest_headers(response.headers, full_body=True)))
+        self.events.on_start(self.whole_length or 0)
+        self.pipeline = self.new_pipeline()
+        self.verifier = self.new_verifier()
+        if self.slice_file:
+            self.slice_file.open(self.whole_length or 0)
+
+    def write_whole_chunk(self, chunk):
+        if self.verifier:
+            self.verifier.add(self.whole_size, len(chunk), chunk)
+        if self.slice_file:
+            self.slice_file.write(self.whole_size, chunk)
+        elif not self.pipeline:
+            self.whole_chunks.append(chunk)
+        self.whole_size += len(chunk)
+        self.add_done_size(len(chunk))
+
+    def set_rate_limit(self, rate, burst=None):
+        """运行时修改本次下载的限速(字节/秒), 0 不限速"""
+        self.rate_bucket.set_rate(rate, burst)
+
+    def is_throttled(self):
+        return bool(self.bandwidth_limiter or self.rate_bucket.rate)
+
+    def throttle_wait(self, url, size):
+        """向全局、host 以及本次下载的令牌桶预约 size 字节, 返回需要等待的秒数"""
+        wait = self.rate_bucket.reserve(size)
+        if self.bandwidth_limiter:
+            wait = max(wait, self.bandwidth_limiter.reserve(url, size))
+        return wait
+
+    def lease_proxy(self, source=None):
+        """指定了代理的下载源直接使用该代理, 否则开启代理时从代理池租用"""
+        if source and source.proxy:
+            return source.proxy, False
+        if self.is_proxy:
+            return self.proxy_pool.lease(), True
+        return "", False
+
+    def release_proxy(self, proxy, response=None, elapsed=0):
+        """归还代理: 请求异常、5xx 以及代理认证/拒绝视为代理失败, 剔除的代理关闭其连接"""
+        success = response is not None and response.status_code < 500 and response.status_code not in (403, 407)
+        size = int(response.headers.get("Content-Length") or 0) if success else 0
+        if self.proxy_pool.release(proxy, success, elapsed, size):
+            self.client_pool.evict(proxy)
+
+    def choose_source(self):
+        return self.source_pool.choose() if self.source_pool else None
+
+    def check_source(self, source, response, file_size=None):
+        """校验响应的 Content-Range 总大小与 ETag 是否与主源一致, 不一致的源直接剔除"""
+        file_size = file_size or self.file_size
+        content_range = response.headers.get("Content-Range")
+        reason = None
+        if content_range and file_size and int(content_range.split("/")[-1]) != file_size:
+            reason = f"文件大小不一致:{content_range}"
+        elif self.etag and response.headers.get("ETag") and response.headers.get("ETag") != self.etag:
+            reason = f"ETag 不一致:{response.headers.get('ETag')}"
+        if reason is None:
+            return True
+        if source and self.source_pool:
+            self.source_pool.drop(source, reason)
+        return False
+
+    def check_slice_response(self, slice_task, source, response):
+        """校验切片响应, 返回错误描述, 校验通过返回 None"""
+        if response.status_code != 206 and response.status_code != 200:
+            return f"下载状态码异常:{response.status_code}"
+        if len(response.content) != slice_task[1] or not self.check_source(source, response):
+            content_length = response.headers.get('Content-Length')
+            return f"文件大小校验失败:{[len(response.content), slice_task[1]], content_length}"
+        return None
+
+    def record_slice(self, size=0, elapsed=0, success=True, source=None, index=None):
+        """上报切片耗时供调度器自适应调整、下载源评分以及事件回调"""
+        if success:
+            self.events.on_slice(index, size, elapsed, source)
+        if source and self.source_pool:
+            self.source_pool.record(source, size, elapsed, success)
+        if self.scheduler:
+            if success:
+                self.scheduler.on_success(size, elapsed)
+            else:
+                self.scheduler.on_failure()
+
+    @staticmethod
+    def slice_offset(slice_task):
+        """根据切片任务的 Range 计算写入偏移量"""
+        if not slice_task[2]["Range"]:
+            return 0
+        return int(slice_task[2]["Range"][6:].split("-")[0])
+
+    @staticmethod
+    def parse_digest_headers(headers, full_body=False):
+        """解析 Digest/Repr-Digest 以及完整响应(200)的 Content-MD5, 返回 {算法: hex}"""
+        digests = {}
+        for name in ("Digest", "Repr-Digest"):
+            for item in (headers.get(name) or "").split(","):
+                algorithm, _, value = item.strip().partition("=")
+                algorithm = algorithm.lower().replace("-", "")
+                if value and hasattr(hashlib, algorithm):
+                    try:
+                        digests[algorithm] = base64.b64decode(value.strip(":")).hex()
+                    except ValueError:
+                        pass
+        if full_body and headers.get("Content-MD5"):
+            try:
+                digests.setdefault("md5", base64.b64decode(headers["Content-MD5"]).hex())
+            except ValueError:
+                pass
+        return digests
+
+    def expected_digest(self):
+        """
+        :return: (算法, 调用方传入的期望摘要 hex), 未指定时为 None
+        """
+        algorithm = self.slice_verify if isinstance(self.slice_verify, str) else None
+        expected = self.slice_digest
+        if expected and ":" in expected:
+            algorithm, expected = expected.split(":", 1)
+        return algorithm, expected.lower() if expected else None
+
+    def new_verifier(self):
+        """
+        开启 slice_verify、传入 slice_digest、使用内容存储或流式变换时创建增量校验器,
+        期望摘要优先取调用方传入的, 其次取响应头; 只有流式变换时不计算整文件哈希, 仅按顺序交给变换管道
+        """
+        consumer = self.pipeline.feed if self.pipeline else None
+        read = self.slice_file.read if self.slice_file else None
+        if not self.slice_verify and not self.slice_digest and not self.content_store:
+            return SliceVerifier(None, read=read, consumer=consumer) if consumer else None
+        algorithm, expected = self.expected_digest()
+        if not expected and self.response_digests:
+            if algorithm not in self.response_digests:
+                algorithm = algorithm if algorithm else sorted(self.response_digests)[-1]
+            expected = self.response_digests.get(algorithm)
+        return SliceVerifier(algorithm or "md5", expected, read, consumer)
+
+    def new_pipeline(self):
+        """传入 slice_transforms 时创建流式变换管道, 区间模式只负责写入共享文件, 由协调进程变换"""
+        if not self.slice_transforms or self.slice_range:
+            return None
+        transforms = self.slice_transforms() if callable(self.slice_transforms) else self.slice_transforms
+        return TransformPipeline(transforms, self.transform_path)
+
+    def finish_pipeline(self, result):
+        """下载成功后结束变换管道, 返回变换后的结果(transform_path 或 bytes)"""
+        if not self.pipeline or result[0] != 2:
+            return result
+        ok, output = self.pipeline.close()
+        if not ok:
+            logger.error(f"【{self.url}】{output},本次下载失败")
+            return 1, b""
+        return 2, output
+
+    def store_keys(self, file_size=None):
+        """
+        内容存储的索引键: 期望摘要; 探测得到大小与 ETag 后加上 url 键(归一化 url、请求方法与请求体、大小、ETag)与 etag 键,
+        url 键带上大小与 ETag, 服务端文件变化或不同参数指向不同文件时不会命中旧内容, 没有 ETag 时不使用 url 键;
+        etag 键需显式开启 store_etag_key, 限定在同一 host 内且只用强 ETag(弱 ETag/mtime-size 类 ETag 可能在不同文件间重复)
+        """
+        keys = []
+        algorithm, expected = self.expected_digest()
+        if expected:
+            keys.append(f"digest:{algorithm or 'md5'}:{expected}")
+        if file_size is not None and self.etag:
+            url_key = MetaCache.key(self.method, self.url_normalizer(self.url), self.data)
+            keys.append(f"url:{url_key}:{file_size}:{self.etag}")
+            if self.store_etag_key and not self.etag.startswith("W/"):
+                keys.append(f"etag:{urlsplit(self.url).netloc.lower()}:{file_size}:{self.etag}")
+        return keys
+
+    def load_from_store(self, file_size=None):
+        """
+        内容存储命中时直接生成结果, 下载前(摘要键)与探测后(url/etag 键)各查一次
+        :return: (state, content), 未命中返回 None
+        """
+        if not self.content_store or self.slice_range or self.slice_transforms:
+            return None
+        hit = self.content_store.lookup(self.store_keys(file_size), file_size)
+        if hit is None:
+            return None
+        path, info = hit
+        self.digest = info["digest"].split(":", 1)[1]
+        self.events.on_start(info["size"])
+        self.add_done_size(info["size"], True)
+        if self.save_path:
+            mode = self.content_store.materialize(path, self.save_path)
+            logger.success(f"【{self.url}】命中内容存储({mode}),已保存至:{self.save_path}")
+            return 2, self.save_path
+        logger.success(f"【{self.url}】命中内容存储")
+        return 2, self.content_store.read(path)
+
+    def save_to_store(self, result):
+        """下载成功后按增量校验得到的摘要保存到内容存储"""
+        if not self.content_store or result[0] != 2 or not self.digest or self.slice_transforms:
+            return result
+        try:
+            digest = f"{self.verifier.algorithm}:{self.digest}"
+            is_path = isinstance(result[1], str)
+            keys = self.store_keys(os.path.getsize(result[1]) if is_path else len(result[1])) + [f"digest:{digest}"]
+            if is_path:
+                self.content_store.put(digest, keys, source_path=result[1])
+            else:
+                self.content_store.put(digest, keys, content=result[1])
+        except OSError as e:
+            logger.warning(f"【{self.url}】保存到内容存储失败:{e}")
+        return result
+
+    def load_cached_slice(self, slice_task):
+        """切片已在清单中完成、是探测时取回的文件开头或命中历史缓存切片(大小一致)时直接提交, 返回 True"""
+        index = slice_task[0]
+        if self.manifest and self.manifest.is_done(index):
+            # 已完成的字节在 open_slice_file 中已计入进度
+            if self.verifier:
+                self.verifier.add(self.slice_offset(slice_task), slice_task[1], checksum=self.manifest.checksum(index)[1])
+            return True
+        if self.probe_content and self.slice_offset(slice_task) == 0 and slice_task[1] <= len(self.probe_content):
+            content, self.probe_content = self.probe_content[:slice_task[1]], None
+            self.commit_slice(slice_task, content)
+            return True
+        if self.manifest:
+            return False
+        if self.slice_cache and len(self.cache_dict.get(index, b"")) == slice_task[1]:
+            self.commit_slice(slice_task, self.cache_dict.pop(index), cached=True)
+            logger.debug("【{}】加载缓存{}号切片成功!", self.url, index)
+            return True
+        return False
+
+    def commit_slice(self, slice_task, content, cached=False):
+        """
+        切片下载成功: 落盘模式按偏移写入目标文件(并记入清单), 否则暂存到 success_list(流式变换时交给管道, 不再暂存);
+        对冲切片只提交最先完成的一份
+        """
+        with self.lock:
+            if slice_task[0] in self.committed:
+                return
+            self.committed[slice_task[0]] = slice_task
+        checksum = self.verifier.checksum(content) if self.verifier else None
+        if self.slice_file:
+            self.slice_file.write(self.slice_offset(slice_task), content)
+            if self.manifest:
+                block_size = self.manifest.info["block_size"]
+                self.manifest.mark(slice_task[0], (slice_task[1] + block_size - 1) // block_size, checksum)
+        elif not self.pipeline:
+            self.success_list[slice_task[0]] = content
+        if self.verifier:
+            self.verifier.add(self.slice_offset(slice_task), len(content), content, checksum)
+        self.add_done_size(len(content), cached)
+
+    def add_done_size(self, size, cached=False):
+        with self.lock:
+            self.done_size += size
+        self.events.on_bytes(size, cached)
+
+    def hedge_slice_tasks(self, scheduler, running):
+        """
+        尾部切片对冲: 任务已全部派发且已完成数据占比达到 slice_hedge_ratio 时,
+        对耗时超过已完成切片中位数 slice_hedge_factor 倍的切片各发起一次对冲请求, 先完成者生效
+        :param running: {task/future: (slice_task, start_time)}
+        :return: 需要发起的对冲切片任务
+        """
+        if not self.slice_hedge or scheduler.has_task() or len(self.slice_times) < 3:
+            return []
+        if self.done_size < self.range_size(scheduler.file_size) * self.slice_hedge_ratio:
+            return []
+        threshold = self.slice_hedge_factor * statistics.median(self.slice_times)
+        now = time.monotonic()
+        hedge_tasks = []
+        for slice_task, start_time in list(running.values()):
+            index = slice_task[0]
+            if index in self.hedged or index in self.committed or now - start_time < threshold:
+                continue
+            hedge_task = (index, slice_task[1], dict(slice_task[2]))  # 新对象, 用于区分原请求与对冲请求
+            self.hedged[index] = (start_time, hedge_task)
+            self.hedge_stats["fired"] += 1
+            hedge_tasks.append(hedge_task)
+            self.events.on_hedge(index, now - start_time)
+            logger.debug("【{}】{}号切片耗时{}s,发起对冲请求", self.url, index, round(now - start_time, 2))
+        return hedge_tasks
+
+    def settle_slice_task(self, slice_task, start_time):
+        """
+        切片请求结束时调用: 记录耗时与对冲收益
+        :return: True 表示该切片刚刚完成, 同一切片的其他在途请求可以放弃
+        """
+        index = slice_task[0]
+        winner = self.committed.get(index)
+        if winner is None or index in self.settled:
+            return False
+        self.settled.add(index)
+        now = time.monotonic()
+        if winner is slice_task:
+            self.slice_times.append(now - start_time)
+        if index in self.hedged:
+            origin_start_time, hedge_task = self.hedged[index]
+            if winner is hedge_task:
+                # 落败请求被放弃, 无法得知其实际耗时, 只能按 slice_timeout 估算节省尾延迟的上限
+                self.hedge_stats["won"] += 1
+                self.hedge_stats["saved_max"] += max(0.0, origin_start_time + self.slice_timeout - now)
+        return True
+
+    def slice_settled(self, index):
+        """切片已由其他请求提交或下载已结束, 该切片的请求无需继续重试"""
+        return index in self.committed or self.finished
+
+    def requeue_corrupted_slices(self):
+        """落盘切片读回后校验和不一致时撤销其提交与清单记录, 加入失败列表重新下载"""
+        if not self.verifier or not self.verifier.corrupted:
+            return
+        block_size = self.scheduler.block_size
+        for offset, size in list(self.verifier.corrupted.items()):
+            index = offset // block_size
+            logger.warning(f"【{self.url}】{index}号切片读回后校验和不一致,重新下载")
+            with self.lock:
+                cached = self.committed.pop(index, None) is None  # 断点续传已完成的切片没有提交记录
+                self.settled.discard(index)
+                self.hedged.pop(index, None)
+                self.done_size -= size
+            self.events.on_discard(size, cached)
+            if self.manifest:
+                self.manifest.unmark(index, (size + block_size - 1) // block_size)
+            self.err_list.append([index, size, {"Range": "bytes={0}-{1}".format(offset, offset + size - 1)}])
+
+    def prune_err_list(self):
+        """去掉已被对冲请求完成的切片以及重复的失败切片"""
+        err_list, indexes = [], set()
+        for slice_task in self.err_list:
+            if slice_task[0] not in self.committed and slice_task[0] not in indexes:
+                indexes.add(slice_task[0])
+                err_list.append(slice_task)
+        self.err_list = err_list
 
     def merge_slice(self):
         return b"".join(self.success_list)
 
+    def open_slice_file(self, file_size):
+        """
+        下载前准备: 增量校验器、落盘文件以及断点续传清单; 区间模式只写入共享文件, 整文件校验由协调进程完成
+        断点续传已完成的字节计入进度后再发出 start 事件
+        """
+        self.pipeline = self.new_pipeline()
+        self.verifier = None if self.slice_range else self.new_verifier()
+        if self.slice_file:
+            file_exists = os.path.exists(self.save_path)
+            self.slice_file.open(file_size)
+            if self.slice_cache and not self.slice_range:
+                block_size = self.block_size(file_size)
+                block_count = (file_size + block_size - 1) // block_size
+                self.manifest = SliceManifest(f"{self.save_path}.manifest")
+                if file_exists and self.manifest.load(file_size, block_size, self.etag, self.last_modified):
+                    logger.info(f"【{self.url}】断点续传:已完成{self.manifest.done_count()}/{block_count}个块")
+                    self.add_done_size(sum(min(block_size, file_size - i * block_size)
+                                           for i in range(block_count) if self.manifest.is_done(i)), True)
+                else:
+                    self.manifest.reset(file_size, block_size, block_count, self.etag, self.last_modified)
+        self.events.on_start(self.range_size(file_size))
+
+    def save_whole_file(self):
+        """
+        不支持切片的附件: 响应体已在探测时流式写入, 校验大小与摘要
+        :return: (state, content) 落盘模式下 content 为文件路径
+        """
+        error = None
+        if self.whole_length is not None and self.whole_size != self.whole_length:
+            error = f"响应体不完整:{self.whole_size}/{self.whole_length}"
+        elif self.verifier:
+            ok, result = self.verifier.verify(self.whole_size)
+            if ok:
+                self.digest = result
+            else:
+                error = result
+        if error:
+            logger.error(f"【{self.url}】{error},本次下载失败")
+            if self.slice_file:
+                self.slice_file.remove()
+            if self.pipeline:
+                self.pipeline.abort()
+            return 1, b""
+        if not self.slice_file:
+            return self.finish_pipeline((2, b"".join(self.whole_chunks)))
+        self.slice_file.close()
+        return self.finish_pipeline((2, self.save_path))
+
+    def merge_result(self, file_size):
+        """
+        校验并返回下载结果
+        :return: (state, content) 落盘模式下 content 为文件路径
+        """
+        file_content = None
+        if self.slice_file:
+            self.slice_file.close()
+            downloaded_size = self.done_size
+        elif self.pipeline:
+            file_content = b""
+            downloaded_size = self.done_size
+        else:
+            file_content = self.merge_slice()
+            downloaded_size = len(file_content)
+        error = None
+        if downloaded_size != self.range_size(file_size):
+            error = "下载后文件大小不等于文件大小"
+        elif self.verifier:
+            ok, result = self.verifier.verify(file_size)
+            if ok:
+                self.digest = result
+            else:
+                error = result
+        if error:
+            logger.error(f"【{self.url}】【{self.unique_id}】{error},本次下载失败")
+            if self.slice_range:
+                self.slice_file.close()  # 共享文件由协调进程处理
+            elif self.slice_file:
+                self.slice_file.remove()
+                if self.manifest:
+                    self.manifest.remove()
+            else:
+                self.remove_cache_dir()  # 删除缓存文件夹
+            if self.pipeline:
+                self.pipeline.abort()
+            return 1, b""
+        if self.digest:
+            logger.debug(f"【{self.url}】{self.verifier.algorithm}摘要校验通过:{self.digest}")
+        if self.slice_file:
+            logger.success(f"【{self.url}】下载成功,已保存至:{self.save_path}")
+            if self.manifest:
+                self.manifest.remove()
+            return self.finish_pipeline((2, self.save_path))
+        logger.success(f"【{self.url}】下载成功")
+        if self.slice_cache:
+            self.remove_cache_dir()  # 下载成功后删除缓存文件夹
+        return self.finish_pipeline((2, file_content))
+
 
 class AsyncSliceDownload(SliceDownloadBase):
 
     def __init__(self, url, method, headers=None, data=None, **request_kwargs):
         super().__init__(url, method, headers, data, **request_kwargs)
 
+    async def request(self, headers, source=None):
+        url = source.url if source else self.url
+        proxy, leased = self.lease_proxy(source)
+        client = self.client_pool.get_async_client(proxy)
+        if source:
+            source.in_flight += 1
+        response = None
+        start_time = time.monotonic()
+        self.events.on_request()
+        try:
+            if self.is_throttled():
+                response = await self.throttled_request(client, url, headers)
+            else:
+                response = await client.request(self.method, url, headers=headers, timeout=self.slice_timeout,
+                                                **self.request_body())
+            return response
+        finally:
+            if source:
+                source.in_flight -= 1
+            if leased:
+                self.release_proxy(proxy, response, time.monotonic() - start_time)
+
+    async def verify_sources(self, file_size):
+        """探测各镜像源, 文件大小或 ETag 与主源不一致的源不参与切片下载"""
+        headers = dict(self.headers)
+        headers["Range"] = "bytes=0-0"
+
+        async def probe(source):
+            try:
+                response = await self.request(headers, source)
+                if response.status_code != 206:
+                    self.source_pool.drop(source, f"不支持切片下载:{response.status_code}")
+                else:
+                    self.check_source(source, response, file_size)
+            except Exception as e:
+                self.source_pool.drop(source, f"探测异常:{e}")
+
+        await asyncio.gather(*[probe(source) for source in self.source_pool.sources[1:]])
+        logger.info(f"【{self.url}】可用下载源:{len(self.source_pool.alive_sources())}/{len(self.source_pool.sources)}")
+
+    async def throttled_request(self, client, url, headers):
+        """限速时按块读取响应体, 每块按令牌桶等待"""
+        chunks = []
+        async with client.stream(self.method, url, headers=headers, timeout=self.slice_timeout,
+                                 **self.request_body()) as response:
+            async for chunk in response.aiter_bytes(self.throttle_chunk_size):
+                chunks.append(chunk)
+                await self.throttle(url, len(chunk))
+        # 响应体已解压, 去掉 Content-Encoding 避免重复解码
+        headers = [(k, v) for k, v in response.headers.items() if k.lower() != "content-encoding"]
+        return httpx.Response(response.status_code, headers=headers, content=b"".join(chunks),
+                              request=response.request)
+
+    async def throttle(self, url, size):
+        wait = self.throttle_wait(url, size)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def request_body(self):
+        """httpx 中 bytes/str 请求体使用 content 参数, 表单使用 data 参数"""
+        if self.data is None:
+            return {}
+        if isinstance(self.data, (bytes, str)):
+            return {"content": self.data}
+        return {"data": self.data}
+
+    async def probe(self, mode):
+        """
+        发送一次探测请求, 不支持 Range 的 200 响应直接流式写入目标
+        :return: 文件大小, HEAD 无法确定时返回 None
+        """
+        proxy, leased = self.lease_proxy()
+        client = self.client_pool.get_async_client(proxy)
+        method = "HEAD" if mode == "head" else self.method
+        body = {} if mode == "head" else self.request_body()
+        self.events.on_request()
+        response = None
+        start_time = time.monotonic()
+        try:
+            async with client.stream(method, self.url, headers=self.probe_headers(mode), timeout=self.slice_timeout,
+                                     **body) as response:
+                if response.status_code == 200 and mode != "head":
+                    self.begin_whole_file(response)
+                    async for chunk in response.aiter_bytes(self.throttle_chunk_size):
+                        self.write_whole_chunk(chunk)
+                        if self.is_throttled():
+                            await self.throttle(self.url, len(chunk))
+                    return self.whole_size
+                content = await response.aread()
+                if self.is_throttled():
+                    await self.throttle(self.url, len(content))
+                return self.accept_probe(mode, response)
+        finally:
+            if leased:
+                self.release_proxy(proxy, response, time.monotonic() - start_time)
+
     async def get_file_size(self):
+        """
+        获取文件元数据: 优先使用未过期的缓存, 否则按 probe_mode 探测, HEAD 无法确定时改用 Range 探测
+        :return: 文件大小, 失败返回 None; 不支持 Range 时 whole_file 为 True, 文件已下载完成
+        """
+        meta = self.cached_meta()
+        if meta and meta.accept_ranges:
+            return meta.size
+        mode = self.probe_mode()
         count = 0
         while count < 3:
             try:
-                headers = copy.deepcopy(self.headers)
-                headers["Range"] = "bytes=0-{}".format(100)
-                proxies = None
-                if self.is_proxy:
-                    ip = self.get_proxy()
-                    if ip:
-                        proxies = {
-                            "http://": "http://{}".format(ip),
-                            "https://": "https://{}".format(ip)
-                        }
-                async with httpx.AsyncClient(proxies=proxies, trust_env=False, verify=False) as client:
-                    response = await client.request(self.method, self.url, headers=headers, timeout=self.slice_timeout)
-                if response.status_code == 206:
-                    content_range = response.headers.get("Content-Range")
-                    if content_range:
-                        return int(content_range.split("/")[-1])
-                elif response.status_code == 200:
-                    return response.content
-                else:
-                    raise Exception(f"【{self.url}】请求状态码异常:{response.status_code}")
+                size = await self.probe(mode)
+                if size is not None:
+                    return size
+                logger.debug("【{}】HEAD 探测无法确定是否支持切片,改用 Range 探测", self.url)
+                mode = "range"
             except Exception as e:
                 count += 1
                 if count == 3:
                     logger.error(f"【{self.url}】获取文件大小重试{count}次失败,本次放弃")
                     return None
                 logger.warning(f"【{self.url}】获取文件大小异常:{e},正在重试第{count}次")
+                await asyncio.sleep(self.retry_policy.delay(count))
 
-    async def slice_download(self, slice_task, slice_semaphore, count=0):
-        async with slice_semaphore:
-            headers = copy.deepcopy(self.headers)
-            index = slice_task[0]
-            if self.slice_cache:
-                if self.cache_dict.get(index):
-                    self.success_list[index] = self.cache_dict.pop(index)
-                    logger.info(f"【{self.url}】加载缓存{index}号切片成功!")
-                    return
-            verify_size = slice_task[1]
-            if slice_task[2]["Range"]:
-                headers["Range"] = slice_task[2]["Range"]
-            try:
-                proxies = None
-                if self.is_proxy:
-                    ip = self.get_proxy()
-                    if ip:
-                        proxies = {
-                            "http://": "http://{}".format(ip),
-                            "https://": "https://{}".format(ip)
-                        }
-                async with httpx.AsyncClient(proxies=proxies, trust_env=False, verify=False) as client:
-                    response = await client.request(self.method, self.url, headers=headers, timeout=self.slice_timeout)
-                if response.status_code == 206 or response.status_code == 200:
-                    if len(response.content) != int(verify_size):
-                        count += 1
-                        if count < self.slice_retry_times:
-                            logger.warning(
-                                f"【{self.url}】{index}号切片文件大小校验失败:"
-                                f"{[len(response.content), int(verify_size)], response.headers.get('Content-Length') or response.headers.get('content-length')}"
-                                f",正在重试第{count}次")
-                            await self.slice_download(slice_task, slice_semaphore, count)
-                        else:
-                            logger.error(f"【{self.url}】{index}号切片下载重试后失败,本次放弃")
-                            self.err_list.append(slice_task)
-                            return
+    async def slice_download(self, slice_task, slice_semaphore):
+        """下载单个切片: 循环重试, 等待退避/熔断期间不占用并发名额"""
+        if self.load_cached_slice(slice_task):
+            return
+        index = slice_task[0]
+        headers = dict(self.headers)
+        if slice_task[2]["Range"]:
+            headers["Range"] = slice_task[2]["Range"]
+        for count in range(1, self.retry_policy.retry_times + 1):
+            source = self.choose_source()
+            url = source.url if source else self.url
+            breaker_wait = self.retry_policy.wait_time(url)
+            while breaker_wait:
+                await asyncio.sleep(breaker_wait)
+                breaker_wait = self.retry_policy.wait_time(url)
+            response = None
+            async with slice_semaphore:
+                start_time = time.monotonic()
+                try:
+                    response = await self.request(headers, source)
+                    error = self.check_slice_response(slice_task, source, response)
+                except Exception as e:
+                    error = f"下载异常:{e}"
+                if error is None:
+                    self.retry_policy.record(url, True)
+                    self.record_slice(slice_task[1], time.monotonic() - start_time, source=source, index=index)
+                    if self.slice_file or self.pipeline:
+                        # 落盘与流式变换(解密/解压)在线程池中执行, 不阻塞事件循环
+                        await asyncio.get_running_loop().run_in_executor(None, self.commit_slice, slice_task,
+                                                                         response.content)
                     else:
-                        self.success_list[index] = response.content
-                        # logger.debug(f"{index}号切片下载成功")
-                        return
-                else:
-                    count += 1
-                    logger.warning(f"【{self.url}】{index}号切片下载状态码异常:{response.status_code},正在重试第{count}次")
-                    await self.slice_download(slice_task, slice_semaphore, count)
-            except Exception as e:
-                count += 1
-                if count < self.slice_retry_times:
-                    logger.warning(f"【{self.url}】{index}号切片下载异常:{e},正在重试第{count}次")
-                    await self.slice_download(slice_task, slice_semaphore, count)
-                else:
-                    logger.error(f"【{self.url}】{index}号切片下载重试后失败,本次放弃")
-                    self.err_list.append(slice_task)
+                        self.commit_slice(slice_task, response.content)
                     return
+            self.retry_policy.record(url, False)
+            self.record_slice(success=False, source=source)
+            if count < self.retry_policy.retry_times:
+                delay = self.retry_policy.delay(count, response)
+                self.events.on_retry(index, count, error, delay)
+                logger.warning("【{}】{}号切片{},{}s后重试第{}次", self.url, index, error, round(delay, 2), count)
+                await asyncio.sleep(delay)
+        logger.error("【{}】{}号切片下载重试后失败,本次放弃", self.url, index)
+        self.err_list.append(slice_task)
+
+    def new_slice_semaphore(self, file_size, value):
+        """切片并发控制: 共享连接预算时按 (优先级, 文件大小) 排队, 小文件优先"""
+        if self.slice_budget:
+            return self.slice_budget.slot(self.url, (self.slice_priority, file_size))
+        return asyncio.Semaphore(value)
+
+    async def run_slice_tasks(self, scheduler, slice_semaphore):
+        """按调度器当前允许的并发数持续派发切片任务, 尾部拖慢的切片发起对冲请求, 直到没有剩余任务"""
+        running = {}
+        while True:
+            while scheduler.has_task() and len(running) < scheduler.limit():
+                slice_task = scheduler.next_task()
+                task = asyncio.create_task(self.slice_download(slice_task, slice_semaphore))
+                running[task] = (slice_task, time.monotonic())
+            if not running:
+                break
+            timeout = 0.2 if self.slice_hedge and not scheduler.has_task() else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task not in running:
+                    continue
+                slice_task, start_time = running.pop(task)
+                task.result()
+                if self.settle_slice_task(slice_task, start_time):
+                    for other in [t for t, (other_task, _) in running.items() if other_task[0] == slice_task[0]]:
+                        other.cancel()
+                        running.pop(other)
+            for hedge_task in self.hedge_slice_tasks(scheduler, running):
+                task = asyncio.create_task(self.slice_download(hedge_task, slice_semaphore))
+                running[task] = (hedge_task, time.monotonic())
+        self.prune_err_list()
 
     async def download(self):
         """
         异步下载
         :return: (state, content) state 0:切换普通方式 1:切片下载失败 2:下载成功
         """
-        if self.slice_cache:
+        result = (1, b"")
+        try:
+            result = await self.slice_download_all()
+            return result
+        finally:
+            self.finished = True
+            self.events.on_finish(result[0])
+            if result[0] != 2 and self.meta_cache:
+                self.meta_cache.evict(self.meta_key)  # 下载失败时元数据可能已过时
+            logger.debug(f"【{self.url}】连接池统计:{self.client_pool.stats()}")
+            if self.manifest:
+                self.manifest.flush()  # 未达到刷新间隔的切片也记入清单, 下次可断点续传
+            if self.slice_file:
+                self.slice_file.close()
+            if self.pipeline and result[0] != 2:
+                self.pipeline.abort()  # 下载失败时不保留不完整的变换结果
+            if self.own_client_pool:
+                await self.client_pool.aclose()
+
+    async def slice_download_all(self):
+        if self.slice_cache and not self.slice_file:
             await self.load_cache()
+        result = self.load_from_store()
+        if result:
+            return result
         file_size = await self.get_file_size()
+        if self.whole_file:
+            logger.debug(f"【{self.url}】附件不支持切片下载功能,已直接下载!")
+            return self.save_to_store(self.save_whole_file())
         if not file_size:
             logger.warning(f"【{self.url}】获取file_size异常,转用普通下载方式")
             return 0, b""
-        if isinstance(file_size, bytes):
-            logger.debug(f"【{self.url}】附件不支持切片下载功能,直接下载成功!")
-            return 2, file_size
+        result = self.load_from_store(file_size)
+        if result:
+            return result
         logger.debug(f"开始下载:【{self.url}】,文件大小:【{round(file_size / (1024 * 1024), 2)}mb】")
-        slice_semaphore = asyncio.Semaphore(self.slice_semaphore)
-        if file_size <= self.slice_min_size:
+        self.open_slice_file(file_size)
+        if self.source_pool:
+            await self.verify_sources(file_size)
+        if file_size <= self.slice_min_size and not self.slice_range:
             logger.info(f"【{self.url}】文件小于切片最小值,直接下载")
             self.success_list = [b""]
             slice_task = [0, file_size, {"Range": None}]
-            await self.slice_download(slice_task, slice_semaphore)
+            await self.slice_download(slice_task, self.new_slice_semaphore(file_size, 1))
         else:
-            slice_tasks = self.calc_slice_task(file_size)
-            down_tasks = [asyncio.create_task(self.slice_download(task, slice_semaphore)) for task in slice_tasks]
-            await asyncio.gather(*down_tasks, return_exceptions=False)
+            scheduler = self.calc_slice_task(file_size)
+            slice_semaphore = self.new_slice_semaphore(file_size, scheduler.semaphore_range[1])
+            await self.run_slice_tasks(scheduler, slice_semaphore)
             for i in range(self.err_list_retry_times):
+                self.requeue_corrupted_slices()
                 if self.err_list:
                     logger.info(f"【{self.url}】本次有{len(self.err_list)}个切片下载失败,开始重试下载")
-                    retry_slice_tasks = self.err_list[:]
+                    scheduler.requeue(self.err_list)
                     self.err_list = []
-                    retry_down_tasks = [asyncio.create_task(self.slice_download(task, slice_semaphore)) for task in
-                                        retry_slice_tasks]
-                    await asyncio.gather(*retry_down_tasks, return_exceptions=False)
+                    await self.run_slice_tasks(scheduler, slice_semaphore)
+            if self.slice_adaptive:
+                logger.debug(f"【{self.url}】自适应调度统计:{scheduler.stats()}")
+            if self.hedge_stats["fired"]:
+                logger.debug(f"【{self.url}】尾部对冲统计:{self.hedge_stats}")
+            if self.source_pool:
+                logger.debug(f"【{self.url}】下载源统计:{self.source_pool.stats()}")
+            if self.is_proxy:
+                logger.debug(f"【{self.url}】代理池统计:{self.proxy_pool.stats()}")
             if self.err_list:
                 logger.error(f"【{self.url}】重试下载后还有{len(self.err_list)}个切片下载失败,本次下载失败")
                 if self.slice_cache:
                     await self.save_cache()
+                if self.slice_file and not self.manifest and not self.slice_range:
+                    self.slice_file.remove()
                 return 1, b""
-        file_content = self.merge_slice()
-        if len(file_content) != file_size:
-            logger.error(f"【{self.url}】下载后文件大小不等于文件大小,本次下载失败")
-            self.remove_cache_dir()  # 删除缓存文件夹
-            return 1, b""
-        logger.success(f"【{self.url}】下载成功")
-        if self.slice_cache:
-            self.remove_cache_dir()  # 下载成功后删除缓存文件夹
-        return 2, file_content
+        return self.save_to_store(self.merge_result(file_size))
+
+
+class BatchDownloader:
+    """
+    批量下载: 多个 url 共享一个连接池与全局/单 host 连接预算, 切片按 (优先级, 文件大小) 排队, 小文件优先完成
+    同时下载的文件数不超过 max_files, 下载结果按完成顺序流式返回, 连接数与内存不随批量大小增长
+
+    用法:
+        batch = BatchDownloader(max_connections=50, save_dir="downloads", slice_size=2 * 1024 * 1024)
+        for url in urls:
+            batch.add(url)
+        async for url, state, content in batch.run():
+            ...
+    """
+
+    def __init__(self, method="GET", headers=None, max_connections=50, max_host_connections=10, max_files=10,
+                 save_dir=None, **request_kwargs):
+        """
+        :param method: 默认请求方法
+        :param headers: 默认请求头
+        :param max_connections: 全局最大连接数
+        :param max_host_connections: 单 host 最大连接数
+        :param max_files: 同时下载的最大文件数
+        :param save_dir: 落盘目录, 设置后每个文件保存为 save_dir/md5(url), 结果返回文件路径
+        :param request_kwargs: 传给 AsyncSliceDownload 的切片配置
+        """
+        self.method = method
+        self.headers = headers
+        self.max_files = max_files
+        self.save_dir = save_dir
+        self.request_kwargs = request_kwargs
+        self.budget = ConnectionBudget(max_connections, max_host_connections)
+        self.client_pool = ClientPool(max_connections=max_connections)
+        self.retry_policy = request_kwargs.get("retry_policy") or RetryPolicy.from_kwargs(request_kwargs)  # 共享熔断状态
+        self.queue = []  # (priority, seq, item)
+        self.seq = itertools.count()
+
+    def add(self, url, priority=0, method=None, headers=None, data=None, save_path=None):
+        """添加下载任务, priority 越小越优先; 运行中也可以继续添加"""
+        if not save_path and self.save_dir:
+            save_path = os.path.join(self.save_dir, myhash(url))
+        item = {"url": url, "method": method or self.method, "headers": headers or self.headers, "data": data,
+                "priority": priority, "save_path": save_path}
+        heapq.heappush(self.queue, (priority, next(self.seq), item))
+
+    async def download_one(self, item):
+        request_kwargs = dict(self.request_kwargs, slice_budget=self.budget, slice_priority=item["priority"],
+                              client_pool=self.client_pool, retry_policy=self.retry_policy)
+        if item["save_path"]:
+            request_kwargs["save_path"] = item["save_path"]
+        try:
+            downloader = AsyncSliceDownload(item["url"], item["method"], item["headers"], item["data"],
+                                            **request_kwargs)
+            state, content = await downloader.download()
+        except Exception as e:
+            logger.error(f"【{item['url']}】批量下载异常:{e}")
+            state, content = 1, b""
+        return item["url"], state, content
+
+    async def run(self):
+        """按完成顺序逐个返回 (url, state, content)"""
+        active = set()
+        try:
+            while self.queue or active:
+                while self.queue and len(active) < self.max_files:
+                    item = heapq.heappop(self.queue)[2]
+                    active.add(asyncio.create_task(self.download_one(item)))
+                done, active = await asyncio.wait(active, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in active:
+                task.cancel()
+            if active:
+                await asyncio.gather(*active, return_exceptions=True)
+            logger.debug(f"批量下载连接池统计:{self.client_pool.stats()}")
+            await self.client_pool.aclose()
 
 
 class ThreadSliceDownload(SliceDownloadBase):
@@ -277,136 +2883,506 @@ class ThreadSliceDownload(SliceDownloadBase):
     def __init__(self, url, method, headers=None, data=None, **request_kwargs):
         super().__init__(url, method, headers, data, **request_kwargs)
 
+    def request(self, headers, source=None):
+        url = source.url if source else self.url
+        proxy, leased = self.lease_proxy(source)
+        if source:
+            with self.lock:
+                source.in_flight += 1
+        session = response = None
+        start_time = time.monotonic()
+        self.events.on_request()
+        try:
+            session = self.client_pool.get_session(proxy)
+            if self.is_throttled():
+                response = self.throttled_request(session, url, headers)
+            else:
+                response = session.request(self.method, url, headers=headers, data=self.data,
+                                           timeout=self.slice_timeout)
+            return response
+        finally:
+            if session is not None:
+                self.client_pool.release_session(proxy, session)
+            if source:
+                with self.lock:
+                    source.in_flight -= 1
+            if leased:
+                self.release_proxy(proxy, response, time.monotonic() - start_time)
+
+    def verify_sources(self, file_size):
+        """探测各镜像源, 文件大小或 ETag 与主源不一致的源不参与切片下载"""
+        headers = dict(self.headers)
+        headers["Range"] = "bytes=0-0"
+        for source in self.source_pool.sources[1:]:
+            try:
+                response = self.request(headers, source)
+                if response.status_code != 206:
+                    self.source_pool.drop(source, f"不支持切片下载:{response.status_code}")
+                else:
+                    self.check_source(source, response, file_size)
+            except Exception as e:
+                self.source_pool.drop(source, f"探测异常:{e}")
+        logger.info(f"【{self.url}】可用下载源:{len(self.source_pool.alive_sources())}/{len(self.source_pool.sources)}")
+
+    def throttled_request(self, session, url, headers):
+        """限速时按块读取响应体, 每块按令牌桶等待"""
+        response = session.request(self.method, url, headers=headers, data=self.data, timeout=self.slice_timeout,
+                                   stream=True)
+        with response:
+            chunks = []
+            for chunk in response.iter_content(self.throttle_chunk_size):
+                chunks.append(chunk)
+                self.throttle(url, len(chunk))
+            response._content = b"".join(chunks)  # 与 requests 读取完整响应体后的状态一致
+        return response
+
+    def throttle(self, url, size):
+        wait = self.throttle_wait(url, size)
+        if wait:
+            time.sleep(wait)
+
+    def probe(self, mode):
+        """
+        发送一次探测请求, 不支持 Range 的 200 响应直接流式写入目标
+        :return: 文件大小, HEAD 无法确定时返回 None
+        """
+        proxy, leased = self.lease_proxy()
+        method = "HEAD" if mode == "head" else self.method
+        data = None if mode == "head" else self.data
+        self.events.on_request()
+        session = response = None
+        start_time = time.monotonic()
+        try:
+            session = self.client_pool.get_session(proxy)
+            response = session.request(method, self.url, headers=self.probe_headers(mode), data=data,
+                                       timeout=self.slice_timeout, stream=True)
+            with response:
+                if response.status_code == 200 and mode != "head":
+                    self.begin_whole_file(response)
+                    for chunk in response.iter_content(self.throttle_chunk_size):
+                        self.write_whole_chunk(chunk)
+                        if self.is_throttled():
+                            self.throttle(self.url, len(chunk))
+                    return self.whole_size
+                if self.is_throttled():
+                    self.throttle(self.url, len(response.content))
+                return self.accept_probe(mode, response)
+        finally:
+            if session is not None:
+                self.client_pool.release_session(proxy, session)
+            if leased:
+                self.release_proxy(proxy, response, time.monotonic() - start_time)
+
     def get_file_size(self):
+        """
+        获取文件元数据: 优先使用未过期的缓存, 否则按 probe_mode 探测, HEAD 无法确定时改用 Range 探测
+        :return: 文件大小, 失败返回 None; 不支持 Range 时 whole_file 为 True, 文件已下载完成
+        """
+        meta = self.cached_meta()
+        if meta and meta.accept_ranges:
+            return meta.size
+        mode = self.probe_mode()
         count = 0
         while count < 3:
             try:
-                headers = copy.deepcopy(self.headers)
-                headers["Range"] = "bytes=0-{}".format(100)
-                proxies = None
-                if self.is_proxy:
-                    ip = self.get_proxy()
-                    if ip:
-                        proxies = {
-                            "http": "{}".format(ip),
-                            "https": "{}".format(ip)
-                        }
-                response = requests.request(self.method, self.url, headers=headers, proxies=proxies,
-                                            timeout=self.slice_timeout, verify=False)
-                if response.status_code == 206:
-                    content_range = response.headers.get("Content-Range")
-                    if content_range:
-                        return int(content_range.split("/")[-1])
-                elif response.status_code == 200:
-                    return response.content
-                else:
-                    raise Exception(f"【{self.url}】请求状态码异常:{response.status_code}")
+                size = self.probe(mode)
+                if size is not None:
+                    return size
+                logger.debug("【{}】HEAD 探测无法确定是否支持切片,改用 Range 探测", self.url)
+                mode = "range"
             except Exception as e:
                 count += 1
                 if count == 3:
                     logger.error(f"【{self.url}】获取文件大小重试{count}次失败,本次放弃")
                     return None
                 logger.warning(f"【{self.url}】获取文件大小异常:{e},正在重试第{count}次")
+                time.sleep(self.retry_policy.delay(count))
 
-    def slice_download(self, slice_task, count=0):
-        headers = copy.deepcopy(self.headers)
+    def slice_download(self, slice_task, count=1):
+        """
+        下载单个切片: 从第 count 次尝试开始; 需要退避或等待熔断时不在线程内等待, 而是交还给 run_slice_tasks
+        按时间重新排队, 不占用并发名额; 切片已被对冲请求完成或下载结束时立即退出
+        :return: None 表示切片已完成或放弃, (delay, count) 表示 delay 秒后从第 count 次尝试继续
+        """
+        if count == 1 and self.load_cached_slice(slice_task):
+            return None
         index = slice_task[0]
-        if self.slice_cache:
-            if self.cache_dict.get(index):
-                self.success_list[index] = self.cache_dict.pop(index)
-                logger.info(f"【{self.url}】加载缓存{index}号切片成功!")
-                return
-        verify_size = slice_task[1]
+        headers = dict(self.headers)
         if slice_task[2]["Range"]:
             headers["Range"] = slice_task[2]["Range"]
-        try:
-            proxies = None
-            if self.is_proxy:
-                ip = self.get_proxy()
-                if ip:
-                    proxies = {
-                        "http": "{}".format(ip),
-                        "https": "{}".format(ip)
-                    }
-            response = requests.request(self.method, self.url, headers=headers, proxies=proxies,
-                                        timeout=self.slice_timeout, verify=False)
-            if response.status_code == 206 or response.status_code == 200:
-                if len(response.content) != int(verify_size):
-                    count += 1
-                    if count < self.slice_retry_times:
-                        logger.warning(
-                            f"【{self.url}】{index}号切片文件大小校验失败:"
-                            f"{[len(response.content), int(verify_size)], response.headers.get('Content-Length') or response.headers.get('content-length')}"
-                            f",正在重试第{count}次")
-                        self.slice_download(slice_task, count)
-                    else:
-                        logger.error(f"【{self.url}】{index}号切片下载重试后失败,本次放弃")
-                        self.err_list.append(slice_task)
-                        return
-                else:
-                    # self.success_list[index] = response.content
-                    # logger.debug(f"{index}号切片下载成功")
-                    return
-            else:
-                count += 1
-                logger.warning(f"【{self.url}】{index}号切片下载状态码异常:{response.status_code},正在重试第{count}次")
-                self.slice_download(slice_task, count)
-        except Exception as e:
-            count += 1
-            if count < self.slice_retry_times:
-                logger.warning(f"【{self.url}】{index}号切片下载异常:{e},正在重试第{count}次")
-                self.slice_download(slice_task, count)
-            else:
-                logger.error(f"【{self.url}】{index}号切片下载重试后失败,本次放弃")
-                self.err_list.append(slice_task)
-                return
+        for count in range(count, self.retry_policy.retry_times + 1):
+            if self.slice_settled(index):
+                return None
+            source = self.choose_source()
+            url = source.url if source else self.url
+            breaker_wait = self.retry_policy.wait_time(url)
+            if breaker_wait:
+                return breaker_wait, count
+            response = None
+            start_time = time.monotonic()
+            try:
+                response = self.request(headers, source)
+                error = self.check_slice_response(slice_task, source, response)
+            except Exception as e:
+                error = f"下载异常:{e}"
+            if error is None:
+                self.retry_policy.record(url, True)
+                self.record_slice(slice_task[1], time.monotonic() - start_time, source=source, index=index)
+                self.commit_slice(slice_task, response.content)
+                return None
+            self.retry_policy.record(url, False)
+            self.record_slice(success=False, source=source)
+            if count < self.retry_policy.retry_times and not self.slice_settled(index):
+                delay = self.retry_policy.delay(count, response)
+                self.events.on_retry(index, count, error, delay)
+                logger.warning("【{}】{}号切片{},{}s后重试第{}次", self.url, index, error, round(delay, 2), count)
+                return delay, count + 1
+        if self.slice_settled(index):
+            return None
+        logger.error("【{}】{}号切片下载重试后失败,本次放弃", self.url, index)
+        self.err_list.append(slice_task)
+        return None
+
+    def slice_download_wait(self, slice_task):
+        """在当前线程内下载单个切片, 退避与熔断等待直接 sleep, 用于不占用线程池名额的单切片下载"""
+        retry = self.slice_download(slice_task)
+        while retry:
+            time.sleep(retry[0])
+            retry = self.slice_download(slice_task, retry[1])
+
+    def run_slice_tasks(self, scheduler, executor):
+        """
+        按调度器当前允许的并发数持续派发切片任务, 尾部拖慢的切片发起对冲请求, 直到没有剩余任务;
+        需要退避或等待熔断的切片按可重新发出的时间排队, 等待期间不占用并发名额
+        """
+        running = {}
+        delayed = []  # 堆: (可重新发出的时间, 序号, 切片任务, 下次尝试次数)
+        seq = itertools.count()
+        while True:
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now and len(running) < scheduler.limit():
+                _, _, slice_task, count = heapq.heappop(delayed)
+                if not self.slice_settled(slice_task[0]):
+                    running[executor.submit(self.slice_download, slice_task, count)] = (slice_task, now)
+            while scheduler.has_task() and len(running) < scheduler.limit():
+                slice_task = scheduler.next_task()
+                running[executor.submit(self.slice_download, slice_task)] = (slice_task, time.monotonic())
+            if not running and not delayed:
+                break
+            timeout = 0.2 if self.slice_hedge and not scheduler.has_task() else None
+            if delayed:
+                timeout = min(timeout or float("inf"), max(0.0, delayed[0][0] - now))
+            if not running:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future not in running:
+                    continue
+                slice_task, start_time = running.pop(future)
+                retry = future.result()
+                if retry:
+                    heapq.heappush(delayed, (time.monotonic() + retry[0], next(seq), slice_task, retry[1]))
+                    continue
+                if self.settle_slice_task(slice_task, start_time):
+                    # 正在执行的线程无法中断, 不再等待其结果即可, 其提交会被忽略
+                    for other in [f for f, (other_task, _) in running.items() if other_task[0] == slice_task[0]]:
+                        other.cancel()
+                        running.pop(other)
+            for hedge_task in self.hedge_slice_tasks(scheduler, running):
+                running[executor.submit(self.slice_download, hedge_task)] = (hedge_task, time.monotonic())
+        self.prune_err_list()
 
     async def download(self):
         """
-        多线程下载
+        多线程下载, 在线程池中执行 download_sync, 不阻塞事件循环
         :return: (state, content) state 0:切换普通方式 1:切片下载失败 2:下载成功
         """
-        if self.slice_cache:
-            await self.load_cache()
+        return await asyncio.get_running_loop().run_in_executor(None, self.download_sync)
+
+    def download_sync(self):
+        """
+        多线程下载(同步接口)
+        :return: (state, content) state 0:切换普通方式 1:切片下载失败 2:下载成功
+        """
+        result = (1, b"")
+        try:
+            result = self.slice_download_all()
+            return result
+        finally:
+            self.finished = True
+            self.events.on_finish(result[0])
+            if result[0] != 2 and self.meta_cache:
+                self.meta_cache.evict(self.meta_key)  # 下载失败时元数据可能已过时
+            logger.debug(f"【{self.url}】连接池统计:{self.client_pool.stats()}")
+            if self.manifest:
+                self.manifest.flush()  # 未达到刷新间隔的切片也记入清单, 下次可断点续传
+            if self.slice_file:
+                self.slice_file.close()
+            if self.pipeline and result[0] != 2:
+                self.pipeline.abort()  # 下载失败时不保留不完整的变换结果
+            if self.own_client_pool:
+                self.client_pool.close()
+
+    def slice_download_all(self):
+        if self.slice_cache and not self.slice_file:
+            asyncio.run(self.load_cache())
+        result = self.load_from_store()
+        if result:
+            return result
         file_size = self.get_file_size()
+        if self.whole_file:
+            logger.debug(f"【{self.url}】附件不支持切片下载功能,已直接下载!")
+            return self.save_to_store(self.save_whole_file())
         if not file_size:
             logger.warning(f"【{self.url}】获取file_size异常,转用普通下载方式")
             return 0, b""
-        if isinstance(file_size, bytes):
-            logger.debug(f"【{self.url}】附件不支持切片下载功能,直接下载成功!")
-            return 2, file_size
+        result = self.load_from_store(file_size)
+        if result:
+            return result
         logger.debug(f"开始下载:【{self.url}】,文件大小:【{round(file_size / (1024 * 1024), 2)}mb】")
-        if file_size <= self.slice_min_size:
+        self.open_slice_file(file_size)
+        if self.source_pool:
+            self.verify_sources(file_size)
+        if file_size <= self.slice_min_size and not self.slice_range:
             logger.info(f"【{self.url}】文件小于切片最小值,直接下载")
             self.success_list = [b""]
             slice_task = [0, file_size, {"Range": None}]
-            with ThreadPoolExecutor(self.slice_semaphore) as executor:
-                executor.map(self.slice_download, [slice_task])
+            self.slice_download_wait(slice_task)
         else:
-            slice_tasks = self.calc_slice_task(file_size)
-            with ThreadPoolExecutor(self.slice_semaphore) as executor:
-                executor.map(self.slice_download, slice_tasks)
-            for i in range(self.err_list_retry_times):
-                if self.err_list:
-                    logger.info(f"【{self.url}】本次有{len(self.err_list)}个切片下载失败,开始重试下载")
-                    retry_slice_tasks = self.err_list[:]
-                    self.err_list = []
-                    with ThreadPoolExecutor(self.slice_semaphore) as executor:
-                        executor.map(self.slice_download, retry_slice_tasks)
+            scheduler = self.calc_slice_task(file_size)
+            executor = ThreadPoolExecutor(scheduler.semaphore_range[1])
+            try:
+                self.run_slice_tasks(scheduler, executor)
+                for i in range(self.err_list_retry_times):
+                    self.requeue_corrupted_slices()
+                    if self.err_list:
+                        logger.info(f"【{self.url}】本次有{len(self.err_list)}个切片下载失败,开始重试下载")
+                        scheduler.requeue(self.err_list)
+                        self.err_list = []
+                        self.run_slice_tasks(scheduler, executor)
+            finally:
+                self.finished = True
+                executor.shutdown(wait=False)  # 被对冲请求取代的慢线程在当前请求结束后退出
+            if self.slice_adaptive:
+                logger.debug(f"【{self.url}】自适应调度统计:{scheduler.stats()}")
+            if self.hedge_stats["fired"]:
+                logger.debug(f"【{self.url}】尾部对冲统计:{self.hedge_stats}")
+            if self.source_pool:
+                logger.debug(f"【{self.url}】下载源统计:{self.source_pool.stats()}")
+            if self.is_proxy:
+                logger.debug(f"【{self.url}】代理池统计:{self.proxy_pool.stats()}")
             if self.err_list:
                 logger.error(f"【{self.url}】重试下载后还有{len(self.err_list)}个切片下载失败,本次下载失败")
                 if self.slice_cache:
-                    await self.save_cache()
+                    asyncio.run(self.save_cache())
+                if self.slice_file and not self.manifest and not self.slice_range:
+                    self.slice_file.remove()
                 return 1, b""
-        file_content = self.merge_slice()
-        if len(file_content) != file_size:
-            logger.error(f"【{self.url}】【{self.unique_id}】下载后文件大小不等于文件大小,本次下载失败")
-            self.remove_cache_dir()  # 删除缓存文件夹
-            return 1, b""
-        logger.success(f"【{self.url}】下载成功")
-        if self.slice_cache:
-            self.remove_cache_dir()  # 下载成功后删除缓存文件夹
-        return 2, file_content
+        return self.save_to_store(self.merge_result(file_size))
+
+
+def process_worker(task_queue, result_queue, request_kwargs, max_files):
+    """ProcessDownloader 的 worker 进程入口"""
+    asyncio.run(process_worker_loop(task_queue, result_queue, request_kwargs, max_files))
+
+
+async def process_worker_loop(task_queue, result_queue, request_kwargs, max_files):
+    """
+    worker 进程: 独立的事件循环与连接池, 从任务队列取文件(或大文件的区间)下载到共享文件,
+    只回传 (任务 id, url, state, 文件路径), 不在进程间传递文件内容
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = request_kwargs.get("slice_semaphore", 20)
+    if request_kwargs.get("slice_adaptive"):
+        semaphore = max(semaphore, request_kwargs.get("slice_semaphore_range", (2, semaphore * 2))[1])
+    client_pool = ClientPool(max_connections=semaphore * max_files)
+    retry_policy = request_kwargs.get("retry_policy") or RetryPolicy.from_kwargs(request_kwargs)
+
+    async def run_item(item):
+        kwargs = dict(request_kwargs, client_pool=client_pool, retry_policy=retry_policy, save_path=item["save_path"])
+        for key in ("slice_range", "file_meta"):
+            if item.get(key):
+                kwargs[key] = item[key]
+        try:
+            downloader = AsyncSliceDownload(item["url"], item["method"], item["headers"], item["data"], **kwargs)
+            state, content = await downloader.download()
+        except Exception as e:
+            logger.error(f"【{item['url']}】多进程下载异常:{e}")
+            state, content = 1, None
+        return item["id"], item["url"], state, content if isinstance(content, str) else None
+
+    active = set()
+    getter = None  # 在线程中阻塞读取任务队列, 与下载任务一起等待
+    finished = False
+    try:
+        while active or not finished:
+            if not finished and getter is None and len(active) < max_files:
+                getter = loop.run_in_executor(None, task_queue.get)
+            done, _ = await asyncio.wait(active | {getter} if getter else active,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                item, getter = getter.result(), None
+                if item is None:
+                    finished = True
+                else:
+                    active.add(asyncio.create_task(run_item(item)))
+            for task in done & active:
+                active.remove(task)
+                result_queue.put(task.result())
+    finally:
+        await client_pool.aclose()
+
+
+class ProcessDownloader:
+    """
+    多进程下载: 单个事件循环受限于一个 CPU 核(TLS、拼接、日志等), 由协调进程把文件或大文件的区间分给多个 worker 进程,
+    每个 worker 运行自己的事件循环与连接池, 结果写入共享文件, 进程间只传递路径与状态
+        with ProcessDownloader(workers=4, save_dir="downloads", slice_size=4 * 1024 * 1024) as downloader:
+            for url, state, path in downloader.map(urls):
+                ...
+            state, path = downloader.download_large(url, "big.bin")
+    request_kwargs 需要可以被 pickle(不能包含 client_pool、slice_hooks 中的 lambda 等), 同一时间只执行一个 map/download_large
+    slice_transforms/transform_path 只用于 download_large, 由协调进程在区间全部完成后按顺序读回文件执行变换
+    """
+
+    def __init__(self, workers=None, method="GET", headers=None, max_files=4, save_dir=None, **request_kwargs):
+        """
+        :param workers: worker 进程数, 默认为 CPU 核数
+        :param method: 默认请求方法
+        :param headers: 默认请求头
+        :param max_files: 每个 worker 同时下载的最大文件数
+        :param save_dir: 落盘目录, 文件保存为 save_dir/md5(url)
+        :param request_kwargs: 传给 AsyncSliceDownload 的切片配置
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.method = method
+        self.headers = headers
+        self.max_files = max_files
+        self.save_dir = save_dir
+        self.slice_transforms = request_kwargs.pop("slice_transforms", None)
+        self.transform_path = request_kwargs.pop("transform_path", None)
+        self.request_kwargs = request_kwargs
+        self.context = multiprocessing.get_context("spawn")
+        self.task_queue = None
+        self.result_queue = None
+        self.processes = []
+        self.seq = itertools.count()
+
+    def start(self):
+        if self.processes:
+            return self
+        self.task_queue = self.context.Queue()
+        self.result_queue = self.context.Queue()
+        for i in range(self.workers):
+            process = self.context.Process(target=process_worker, daemon=True, args=(
+                self.task_queue, self.result_queue, self.request_kwargs, self.max_files))
+            process.start()
+            self.processes.append(process)
+        return self
+
+    def stop(self):
+        for _ in self.processes:
+            self.task_queue.put(None)
+        for process in self.processes:
+            process.join(10)
+            if process.is_alive():
+                process.kill()
+        self.processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def new_item(self, url, method=None, headers=None, data=None, save_path=None, **kwargs):
+        if not save_path:
+            if not self.save_dir:
+                raise Exception("多进程下载需要设置 save_dir 或 save_path, 结果通过文件返回")
+            save_path = os.path.join(self.save_dir, myhash(url))
+        return dict(kwargs, id=next(self.seq), url=url, method=method or self.method, headers=headers or self.headers,
+                    data=data, save_path=save_path)
+
+    def run_items(self, items):
+        """提交任务并按完成顺序返回 (任务 id, url, state, 文件路径)"""
+        self.start()
+        for item in items:
+            self.task_queue.put(item)
+        for _ in items:
+            while True:
+                try:
+                    yield self.result_queue.get(timeout=1)
+                    break
+                except queue.Empty:
+                    if not all(process.is_alive() for process in self.processes):
+                        raise Exception("worker 进程异常退出")
+
+    def map(self, items):
+        """
+        下载多个文件, 按完成顺序逐个返回 (url, state, 文件路径)
+        :param items: url 或 {"url": url, "method":, "headers":, "data":, "save_path":}
+        """
+        items = [self.new_item(**item) if isinstance(item, dict) else self.new_item(item) for item in items]
+        for _, url, state, path in self.run_items(items):
+            yield url, state, path
+
+    def download_large(self, url, save_path, method=None, headers=None, data=None):
+        """
+        单个大文件: 协调进程探测元数据(探测取回的文件开头直接写入)并预分配文件,
+        剩余部分按块对齐切成 workers 个区间, 各 worker 并行写入同一个文件, 全部完成后按需校验整文件摘要
+        :return: (state, content) state 0:切换普通方式 1:切片下载失败 2:下载成功
+        """
+        coordinator = ThreadSliceDownload(url, method or self.method, headers or self.headers, data,
+                                          **dict(self.request_kwargs, save_path=save_path, slice_cache=False,
+                                                 slice_transforms=self.slice_transforms,
+                                                 transform_path=self.transform_path))
+        try:
+            file_size = coordinator.get_file_size()
+            if coordinator.whole_file:
+                return coordinator.save_whole_file()
+            if not file_size:
+                logger.warning(f"【{url}】获取file_size异常,转用普通下载方式")
+                return 0, b""
+            block_size = coordinator.block_size(file_size)
+            coordinator.slice_file.open(file_size)
+            start = 0
+            if coordinator.probe_content:
+                start = min(len(coordinator.probe_content) // block_size * block_size, file_size)
+                if len(coordinator.probe_content) >= file_size:
+                    start = file_size
+                coordinator.slice_file.write(0, coordinator.probe_content[:start])
+            block_count = (file_size - start + block_size - 1) // block_size
+            per_worker = max(1, (block_count + self.workers - 1) // self.workers) * block_size
+            meta = FileMeta(file_size, coordinator.etag, coordinator.last_modified, True, coordinator.response_digests)
+            items = [self.new_item(url, method, headers, data, save_path, slice_range=(offset, min(offset + per_worker,
+                                                                                                   file_size)),
+                                   file_meta=meta) for offset in range(start, file_size, per_worker)]
+            logger.info(f"【{url}】文件大小:{file_size},分为{len(items)}个区间交给 worker 进程下载")
+            failed = [result for result in self.run_items(items) if result[2] != 2]
+            if failed:
+                logger.error(f"【{url}】{len(failed)}个区间下载失败,本次下载失败")
+                coordinator.slice_file.remove()
+                return 1, b""
+            coordinator.pipeline = coordinator.new_pipeline()
+            verifier = coordinator.new_verifier()
+            if verifier:
+                for offset in range(0, file_size, block_size):
+                    verifier.add(offset, min(block_size, file_size - offset))
+                ok, result = verifier.verify(file_size)
+                if not ok:
+                    logger.error(f"【{url}】{result},本次下载失败")
+                    coordinator.slice_file.remove()
+                    if coordinator.pipeline:
+                        coordinator.pipeline.abort()
+                    return 1, b""
+                coordinator.digest = result
+            logger.success(f"【{url}】多进程下载成功,已保存至:{save_path}")
+            return coordinator.finish_pipeline((2, save_path))
+        finally:
+            coordinator.slice_file.close()
+            if coordinator.own_client_pool:
+                coordinator.client_pool.close()
 
 
 if __name__ == '__main__':
@@ -418,15 +3394,48 @@ if __name__ == '__main__':
         "slice_semaphore": 50,  # 切片最大并发量
         "slice_timeout": 20,  # 切片超时时间
         "slice_cache": True,  # 切片缓存功能
-        "slice_mode": "thread",  # 切片模式，thread：多线程 默认异步
-        "is_proxy": False,  # 是否使用代理
+        "save_path": None,  # 落盘模式保存路径, 设置后切片直接写入文件, 返回文件路径(同时开启 slice_cache 则断点续传)
+        "slice_mode": "thread",  # 切片模式，thread：多线程 process：多进程(大文件按区间分给 worker 进程) 默认异步
+        "is_proxy": False,  # 是否使用代理(未传入 proxy_pool 时通过 get_proxy 获取代理)
+        "proxy_pool": None,  # 代理池 ProxyPool(["ip:port", ...]), 按健康度租用代理
         "slice_retry_times": 10,  # 切片重试次数为10(单个切片重试次数)
-        "err_list_retry_times": 1  # 失败列表重试次数为1(完整任务执行完后 失败列表整体重试次数)
+        "slice_backoff_base": 0.5,  # 重试退避基数(秒), 指数退避加随机抖动, 响应带 Retry-After 时优先遵循
+        "slice_backoff_max": 10,  # 重试退避上限(秒)
+        "slice_breaker_threshold": 10,  # 单 host 连续失败多少次熔断
+        "slice_breaker_timeout": 10,  # 熔断时间(秒)
+        "err_list_retry_times": 1,  # 失败列表重试次数为1(完整任务执行完后 失败列表整体重试次数)
+        "slice_adaptive": False,  # 根据实测吞吐自适应调整切片大小与并发数
+        "slice_size_range": (512 * 1024, 32 * 1024 * 1024),  # 自适应切片大小上下限
+        "slice_semaphore_range": (2, 100),  # 自适应并发数上下限
+        "slice_target_time": 2,  # 自适应期望的单个切片耗时(秒)
+        "slice_hedge": True,  # 尾部拖慢的切片发起对冲请求, 先完成者生效
+        "slice_hedge_factor": 3,  # 耗时超过已完成切片中位数的倍数视为拖慢
+        "slice_hedge_ratio": 0.9,  # 已完成数据占比达到该值后才开始对冲
+        "slice_transforms": None,  # 流式变换, 如 [AesDecryptTransform(key, iv), GzipDecompressTransform()], 按顺序边下载边解密/解压
+        "transform_path": None,  # 变换结果保存路径, 为 None 时返回变换后的 bytes(save_path 仍保存原始文件)
+        "slice_verify": None,  # 边下载边计算整文件哈希(md5/sha256...), 与响应头 Digest/Content-MD5 比对
+        "slice_digest": None,  # 期望的整文件摘要 hex 或 "算法:hex"
+        "slice_hooks": [],  # 事件回调 callback(event: dict), 如 TqdmProgress()、PrometheusExporter()
+        "slice_progress_interval": 0.5,  # progress 事件的最小间隔(秒)
+        "slice_probe": "auto",  # 元数据探测方式: auto(按缓存选择 HEAD/Range)/range/head
+        "slice_probe_size": None,  # Range 探测取回的字节数(作为第一个切片), 默认等于 slice_size
+        "meta_cache": None,  # 文件元数据缓存, 默认不缓存; 传入共享的 meta_cache 或 MetaCache(ttl=300) 后 ttl 内不再探测
+        "content_store": None,  # 内容寻址存储 ContentStore("cache_store"), 按摘要/url+大小+ETag 命中本地文件
+        "url_normalizer": normalize_url,  # 内容存储 url 键的归一化方法, 默认不改写; strip_volatile_params 去掉签名/过期参数
+        "store_etag_key": False,  # 内容存储是否按 host+大小+强 ETag 跨 url 命中(站点 ETag 为内容哈希时才开启)
+        "slice_rate_limit": 0,  # 本次下载限速(字节/秒), 0 不限速, 运行时可通过 set_rate_limit 修改
+        "bandwidth_limiter": None,  # 多个下载共享的全局/单 host 限速 BandwidthLimiter(rate, host_rate)
+        "sources": [],  # 镜像源: url 或 {"url": url, "proxy": ip}, 按实测吞吐分配切片
     }
     if t_slice_config["slice_mode"] == "thread":
         logger.info("切片模式:多线程")
-        state, file_data = asyncio.run(ThreadSliceDownload(t_url, t_method, **t_slice_config).download())
+        state, file_data = ThreadSliceDownload(t_url, t_method, **t_slice_config).download_sync()
+    elif t_slice_config["slice_mode"] == "process":
+        logger.info("切片模式:多进程")
+        with ProcessDownloader(method=t_method, **t_slice_config) as t_downloader:
+            state, file_data = t_downloader.download_large(t_url, t_slice_config["save_path"] or myhash(t_url))
     else:
         logger.info("切片模式:异步")
         state, file_data = asyncio.run(AsyncSliceDownload(t_url, t_method, **t_slice_config).download())
-    logger.debug(f"下载完成:state: {state}, file_size: {round(len(file_data) / (1024 * 1024), 2)}mb")
+    t_file_size = os.path.getsize(file_data) if isinstance(file_data, str) else len(file_data)
+    logger.debug(f"下载完成:state: {state}, file_size: {round(t_file_size / (1024 * 1024), 2)}mb")
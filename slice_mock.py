@@ -0,0 +1,227 @@
+# -*- coding: UTF-8 -*-
+# @author:
+# @file: slice_mock
+# @time: 2026-10-18
+# @desc: 切片下载本地测试服务: 假代理, 支持 Range 的文件服务
+
+import http.client
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+class FakeProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.forward()
+
+    def do_HEAD(self):
+        self.forward()
+
+    def do_POST(self):
+        self.forward()
+
+    def forward(self):
+        proxy = self.server.fake_proxy
+        proxy.requests += 1
+        if proxy.dead:
+            self.close_connection = True
+            return
+        if proxy.delay:
+            time.sleep(proxy.delay)
+        if proxy.error_rate and random.random() < proxy.error_rate:
+            self.send_response(502)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        target = urlsplit(self.path)
+        body = None
+        if self.headers.get("Content-Length"):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in ("proxy-connection", "connection")}
+        conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+        try:
+            path = target.path + ("?" + target.query if target.query else "")
+            conn.request(self.command, path or "/", body=body, headers=headers)
+            response = conn.getresponse()
+            content = response.read()
+        finally:
+            conn.close()
+        self.send_response(response.status)
+        for k, v in response.getheaders():
+            if k.lower() not in ("connection", "transfer-encoding", "content-length"):
+                self.send_header(k, v)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+
+class FakeProxy:
+    """
+    本地假 HTTP 代理(仅支持 http 目标), 用于测试代理池:
+        dead: 直接断开连接, 模拟失效出口
+        delay: 每个请求延迟秒数, 模拟慢出口
+        error_rate: 按概率返回 502, 模拟不稳定出口
+    用法:
+        with FakeProxy(delay=0.5) as proxy:
+            ProxyPool([proxy.address])
+    """
+
+    def __init__(self, dead=False, delay=0, error_rate=0, port=0):
+        self.dead = dead
+        self.delay = delay
+        self.error_rate = error_rate
+        self.requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), FakeProxyHandler)
+        self.server.daemon_threads = True
+        self.server.fake_proxy = self
+        self.thread = None
+
+    @property
+    def address(self):
+        return "{}:{}".format(*self.server.server_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+class RangeServerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.serve()
+
+    def do_HEAD(self):
+        self.serve()
+
+    def serve(self):
+        server = self.server.range_server
+        with server.lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            self.send_response(random.choice((500, 502, 503)))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = server.data
+        start, end = 0, len(data) - 1
+        match = server.accept_ranges and re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range") or "")
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        if server.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", server.etag)
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        if server.truncate_rate and random.random() < server.truncate_rate:
+            end = start + (end - start) // 2  # 只发送一半数据后断开, 模拟截断的响应体
+            self.close_connection = True
+        self.send_body(server, start, end + 1)
+
+    def send_body(self, server, start, stop):
+        view = memoryview(server.data)
+        chunk_size = 64 * 1024
+        begin = time.perf_counter()
+        sent = 0
+        for offset in range(start, stop, chunk_size):
+            chunk = view[offset:min(offset + chunk_size, stop)]
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            if server.bandwidth:
+                # 按单连接带宽上限限速
+                wait = sent / server.bandwidth - (time.perf_counter() - begin)
+                if wait > 0:
+                    time.sleep(wait)
+
+
+class RangeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # 高并发切片时避免 listen 队列溢出
+
+
+class RangeServer:
+    """
+    本地支持 Range 的文件服务, 用于测试与基准测试切片下载:
+        size: 文件大小(字节), 内容由 seed 确定, 可复现
+        latency: 每个请求的首字节延迟秒数
+        bandwidth: 单连接带宽上限(字节/秒), 0 表示不限速
+        error_rate: 按概率返回 500/502/503
+        truncate_rate: 按概率只发送一半响应体后断开
+        accept_ranges: 为 False 时忽略 Range 请求头, 总是返回完整文件(200), 模拟不支持切片的服务端
+        requests: 已处理的请求数
+    用法:
+        with RangeServer(size=64 * 1024 * 1024, latency=0.02) as server:
+            AsyncSliceDownload(server.url, "GET").download()
+    """
+
+    def __init__(self, size=16 * 1024 * 1024, latency=0, bandwidth=0, error_rate=0, truncate_rate=0, seed=0,
+                 port=0, accept_ranges=True):
+        self.data = random.Random(seed).randbytes(size)
+        self.etag = '"{}-{}"'.format(size, seed)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.accept_ranges = accept_ranges
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = RangeHTTPServer(("127.0.0.1", port), RangeServerHandler)
+        self.server.range_server = self
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}/file".format(*self.server.server_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
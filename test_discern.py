@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+# @author:
+# @file: test_discern
+# @time: 2026-10-18
+# @desc: 滑块裁剪回归测试, 对比向量化 clear_white 与原逐像素实现, 运行: python -m pytest -q test_discern.py
+#        直接运行 python test_discern.py 输出两种实现的耗时对比
+
+import timeit
+
+import cv2
+import numpy as np
+import pytest
+
+from discern import SlideCrack
+
+
+def clear_white_loop(img):
+    """原逐像素实现(min/max 用 elif 更新, 初始值 255), 用于对比裁剪结果与耗时"""
+    img = cv2.imdecode((np.frombuffer(img, np.uint8)), cv2.IMREAD_COLOR)
+    rows, cols, channel = img.shape
+    min_x = 255
+    min_y = 255
+    max_x = 0
+    max_y = 0
+    for x in range(1, rows):
+        for y in range(1, cols):
+            t = set(img[x, y])
+            if len(t) >= 2:
+                if x <= min_x:
+                    min_x = x
+                elif x >= max_x:
+                    max_x = x
+                if y <= min_y:
+                    min_y = y
+                elif y >= max_y:
+                    max_y = y
+    img1 = img[min_x:max_x, min_y: max_y]
+    return img1
+
+
+def encode(t_img):
+    return cv2.imencode(".png", t_img)[1].tobytes()
+
+
+def new_slide_piece(height, width, seed):
+    """生成滑块图: 灰白背景上随机位置的彩色拼图块, 返回 png 字节"""
+    rng = np.random.default_rng(seed)
+    t_img = np.full((height, width, 3), rng.integers(200, 256), np.uint8)
+    piece_h = int(rng.integers(height // 3, height * 2 // 3))
+    piece_w = int(rng.integers(width // 3, width * 2 // 3))
+    top, left = int(rng.integers(1, height - piece_h)), int(rng.integers(1, width - piece_w))
+    t_img[top:top + piece_h, left:left + piece_w] = rng.integers(0, 256, (piece_h, piece_w, 3), np.uint8)
+    cv2.circle(t_img, (left + piece_w, top + piece_h // 2), max(piece_h // 6, 2), (30, 120, 200), -1)
+    return encode(t_img)
+
+
+# 原实现 min 初始值为 255, 只在宽高都不超过 255 的图片上结果正确, 对比使用常见滑块尺寸
+@pytest.mark.parametrize("height, width", [(50, 50), (68, 68), (110, 110), (160, 60), (255, 255)])
+def test_clear_white_matches_loop(height, width):
+    for seed in range(20):
+        t_piece = new_slide_piece(height, width, seed)
+        assert np.array_equal(SlideCrack.clear_white(t_piece), clear_white_loop(t_piece)), f"seed={seed}"
+
+
+def test_clear_white_edge_cases_match_loop():
+    t_img = np.full((60, 60, 3), 230, np.uint8)
+    pieces = [encode(t_img)]  # 没有滑块
+    t_img[0, :] = t_img[:, 0] = (10, 20, 30)  # 只在第 0 行/列, 不参与统计
+    pieces.append(encode(t_img))
+    t_img = np.full((60, 60, 3), 230, np.uint8)
+    t_img[20, 30] = (10, 20, 30)  # 单个像素
+    pieces.append(encode(t_img))
+    t_img[20, 10:50] = (10, 20, 30)  # 单行: elif 不更新 max_x, 两种实现都裁成空图
+    pieces.append(encode(t_img))
+    t_img[10:50, 40] = (10, 20, 30)
+    pieces.append(encode(t_img))
+    for t_piece in pieces:
+        assert np.array_equal(SlideCrack.clear_white(t_piece), clear_white_loop(t_piece))
+
+
+def test_clear_white_beyond_255():
+    """滑块位于 255 像素之后时原实现的 min 停在 255, 向量化实现按实际范围裁剪"""
+    t_img = np.full((300, 300, 3), 230, np.uint8)
+    t_img[260:290, 270:295] = (10, 20, 30)
+    t_piece = encode(t_img)
+    assert SlideCrack.clear_white(t_piece).shape == (29, 24, 3)
+    assert clear_white_loop(t_piece).shape == (34, 39, 3)
+
+
+if __name__ == '__main__':
+    for t_height, t_width in ((50, 50), (68, 68), (110, 110), (160, 60), (255, 255)):
+        t_piece = new_slide_piece(t_height, t_width, 0)
+        t_number = 20
+        t_loop_cost = timeit.timeit(lambda: clear_white_loop(t_piece), number=t_number) / t_number * 1e3
+        t_cost = timeit.timeit(lambda: SlideCrack.clear_white(t_piece), number=t_number) / t_number * 1e3
+        print(f"{t_width}x{t_height} 逐像素:{t_loop_cost:.2f}ms 向量化:{t_cost:.3f}ms 提速:{t_loop_cost / t_cost:.0f}倍")
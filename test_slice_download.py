@@ -0,0 +1,347 @@
+# -*- coding: UTF-8 -*-
+# @author:
+# @file: test_slice_download
+# @time: 2026-10-18
+# @desc: 切片下载测试, 使用 slice_mock 本地服务, 运行: python -m pytest -q test_slice_download.py
+
+import asyncio
+import gzip
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+
+import pytest
+
+import crypto
+from slice_download import (AesDecryptTransform, AsyncSliceDownload, CircuitBreaker, ClientPool, ContentStore,
+                            GzipDecompressTransform, HashTransform, MetaCache, ProxyPool, SliceManifest,
+                            ThreadSliceDownload)
+from slice_mock import FakeProxy, RangeServer, RangeServerHandler
+
+
+@pytest.fixture
+def server():
+    with RangeServer(size=1024 * 1024, error_rate=1) as server:
+        yield server
+
+
+class LoserSliceDownload(ThreadSliceDownload):
+    """模拟对冲落败的请求: 请求期间另一份请求已提交该切片, 本次请求随后失败"""
+
+    def request(self, headers, source=None):
+        self.requests += 1
+        self.commit_slice(self.winner, self.content)
+        return super().request(headers, source)
+
+
+def new_download(cls, server, **kwargs):
+    download = cls(server.url, "GET", slice_retry_times=5, slice_backoff_base=0.01, meta_cache=MetaCache(),
+                   **kwargs)
+    download.success_list = [b""]
+    return download
+
+
+def test_loser_exits_after_slice_committed(server):
+    download = new_download(LoserSliceDownload, server)
+    download.requests = 0
+    download.content = server.data[:1024]
+    download.winner = (0, 1024, {"Range": "bytes=0-1023"})
+    download.slice_download([0, 1024, {"Range": "bytes=0-1023"}])
+    assert download.requests == 1  # 提交后不再重试
+    assert download.err_list == []
+    assert download.success_list[0] == server.data[:1024]
+
+
+def test_worker_exits_after_download_finished(server):
+    download = new_download(ThreadSliceDownload, server)
+    download.finished = True
+    download.client_pool.close()
+    before = server.requests
+    worker = threading.Thread(target=download.slice_download, args=([0, 1024, {"Range": "bytes=0-1023"}],))
+    worker.start()
+    worker.join(5)
+    assert not worker.is_alive()
+    assert server.requests == before
+    assert download.err_list == []
+    assert download.client_pool.stats()["clients"] == 0  # 关闭后不再新建 Session
+
+
+def test_breaker_half_open_allows_single_probe():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0.05)
+    breaker.record("host", False)
+    breaker.record("host", False)
+    assert breaker.wait_time("host") > 0
+    time.sleep(0.06)
+    assert breaker.wait_time("host") == 0  # 第一个请求作为试探放行
+    assert breaker.wait_time("host") > 0  # 试探结果返回前其他请求继续等待
+    breaker.record("host", True)
+    assert breaker.wait_time("host") == 0
+
+
+def test_proxy_pool_probes_untested_proxy_once():
+    pool = ProxyPool(["a:1", "b:1"])
+    first, second = pool.lease(), pool.lease()
+    assert {first, second} == {"a:1", "b:1"}  # 每个未测速代理同时只有一个试探请求
+    pool.release(first, True, 0.1)
+    assert pool.lease() == first  # 已测速的代理优先于试探中的代理
+
+
+def test_proxy_pool_lease_falls_back_to_cooling_proxy():
+    pool = ProxyPool(["a:1"], max_failures=3)
+    pool.release(pool.lease(), False)
+    assert pool.lease() == "a:1"  # 全部在冷却时仍使用代理, 不退回直连
+    assert ProxyPool().lease() == ""
+
+
+def test_thread_sessions_bounded_across_downloads():
+    pool = ClientPool(max_connections=4)
+    with RangeServer(size=1024 * 1024) as server:
+        for _ in range(3):
+            download = ThreadSliceDownload(server.url, "GET", slice_size=128 * 1024, slice_min_size=1,
+                                           slice_semaphore=4, client_pool=pool, meta_cache=MetaCache())
+            assert download.download_sync() == (2, server.data)
+    stats = pool.stats()
+    assert stats["clients"] <= 4  # Session 归还复用, 不随下载线程数增长
+    assert 0 < stats["connections"] <= 4 < stats["requests"]
+    pool.close()
+
+
+def test_manifest_flush_is_throttled(tmp_path):
+    path = str(tmp_path / "file.manifest")
+    manifest = SliceManifest(path, flush_slices=2, flush_interval=3600)
+    manifest.reset(4096, 1024, 4)
+    manifest.mark(0)
+    saved = SliceManifest(path)
+    assert saved.load(4096, 1024) and saved.done_count() == 0  # 未达到刷新条件, 不写文件
+    manifest.mark(1)
+    manifest.mark(2)
+    saved = SliceManifest(path)
+    assert saved.load(4096, 1024) and saved.done_count() == 2  # 每 2 个切片刷新一次
+    manifest.flush()
+    saved = SliceManifest(path)
+    assert saved.load(4096, 1024) and saved.done_count() == 3
+
+
+def store_download(server, path, store, **kwargs):
+    download = ThreadSliceDownload(server.url.replace("/file", path), "GET", slice_size=64 * 1024, slice_min_size=1,
+                                   content_store=store, meta_cache=MetaCache(), **kwargs)
+    before = server.requests
+    result = download.download_sync()
+    return result, server.requests - before
+
+
+def test_content_store_does_not_share_etag_across_urls(tmp_path):
+    store = ContentStore(str(tmp_path / "store"))
+    with RangeServer(size=256 * 1024) as server:
+        assert store_download(server, "/a?token=1", store)[0] == (2, server.data)
+        result, requests_count = store_download(server, "/b?token=2", store)
+        assert result == (2, server.data) and requests_count > 1  # 不同 url 大小/ETag 相同也重新下载
+        result, requests_count = store_download(server, "/a?token=1", store)
+        assert result == (2, server.data) and requests_count == 1  # 同一 url 探测后命中
+        store_download(server, "/c", store, store_etag_key=True)
+        result, requests_count = store_download(server, "/f", store, store_etag_key=True)
+        assert result == (2, server.data) and requests_count == 1  # 显式开启后按 host+ETag 命中
+        server.etag = 'W/"weak"'
+        store_download(server, "/d", store, store_etag_key=True)
+        result, requests_count = store_download(server, "/e", store, store_etag_key=True)
+        assert result == (2, server.data) and requests_count > 1  # 弱 ETag 从不跨 url 命中
+
+
+def test_client_pool_follows_adaptive_upper_bound():
+    download = ThreadSliceDownload("http://127.0.0.1/file", "GET", slice_semaphore=4)
+    assert download.client_pool.max_connections == 4
+    download = ThreadSliceDownload("http://127.0.0.1/file", "GET", slice_semaphore=4, slice_adaptive=True)
+    assert download.client_pool.max_connections == 8  # 默认上限为 slice_semaphore * 2
+    download = AsyncSliceDownload("http://127.0.0.1/file", "GET", slice_semaphore=4, slice_adaptive=True,
+                                  slice_semaphore_range=(2, 30))
+    assert download.client_pool.max_connections == 30
+
+
+def run_download(cls, url, **kwargs):
+    download = cls(url, "GET", **kwargs)
+    result = download.download_sync() if cls is ThreadSliceDownload else asyncio.run(download.download())
+    return download, result
+
+
+@pytest.mark.parametrize("cls", [ThreadSliceDownload, AsyncSliceDownload])
+def test_transform_pipeline_decrypts_and_decompresses(cls, tmp_path):
+    plain = random.Random(1).randbytes(512 * 1024) + b"hello" * 100000
+    cipher = crypto.AesCipher(b"k" * 16, b"i" * 16)
+    with RangeServer(size=1) as server:
+        server.data = cipher.encrypt(gzip.compress(plain, 1))
+        digest = HashTransform("sha256")
+        transform_path = str(tmp_path / "plain.bin")
+        download, result = run_download(
+            cls, server.url, slice_size=64 * 1024, slice_min_size=64 * 1024, meta_cache=MetaCache(),
+            slice_transforms=[AesDecryptTransform(b"k" * 16, b"i" * 16), GzipDecompressTransform(), digest],
+            transform_path=transform_path)
+        assert result == (2, transform_path)
+        with open(transform_path, "rb") as f:
+            assert f.read() == plain
+        assert digest.hexdigest() == hashlib.sha256(plain).hexdigest()
+        bad_path = str(tmp_path / "bad.bin")
+        download, result = run_download(
+            cls, server.url, slice_size=64 * 1024, slice_min_size=64 * 1024, meta_cache=MetaCache(),
+            slice_transforms=[AesDecryptTransform(b"x" * 16, b"i" * 16), GzipDecompressTransform()],
+            transform_path=bad_path)
+        assert result[0] == 1 and not os.path.exists(bad_path)  # 密钥错误时不保留不完整的结果
+
+
+class TruncateFirstServer(RangeServer):
+    """第一个响应体只发送一半后断开, 之后的响应完整"""
+
+    @property
+    def truncate_rate(self):
+        return 1 if self.requests <= 1 else 0
+
+    @truncate_rate.setter
+    def truncate_rate(self, value):
+        pass
+
+
+def open_files(directory):
+    """当前进程仍打开着的 directory 下的文件"""
+    paths = []
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            path = os.readlink(f"/proc/self/fd/{fd}")
+        except OSError:
+            continue
+        if path.startswith(str(directory)):
+            paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize("cls", [ThreadSliceDownload, AsyncSliceDownload])
+def test_whole_file_probe_retry_reopens_target(cls, tmp_path):
+    save_path, transform_path = str(tmp_path / "file.bin"), str(tmp_path / "file.plain")
+    with TruncateFirstServer(size=512 * 1024, accept_ranges=False) as server:
+        download, result = run_download(cls, server.url, save_path=save_path, transform_path=transform_path,
+                                        slice_transforms=lambda: [HashTransform("sha256")], meta_cache=MetaCache(),
+                                        slice_backoff_base=0.01)
+        assert server.requests == 2  # 第一次整文件响应被截断后重试
+        assert result == (2, transform_path)
+        for path in (save_path, transform_path):
+            with open(path, "rb") as f:
+                assert f.read() == server.data
+        assert not open_files(tmp_path)  # 重试前关闭了上次打开的目标文件
+
+
+@pytest.mark.parametrize("cls", [ThreadSliceDownload, AsyncSliceDownload])
+def test_proxy_pool_avoids_dead_proxy(cls):
+    with RangeServer(size=1024 * 1024) as server, FakeProxy() as good, FakeProxy(dead=True) as dead:
+        pool = ProxyPool([dead.address, good.address], max_failures=2, cooldown=60)
+        download, result = run_download(cls, server.url, slice_size=64 * 1024, slice_min_size=1, slice_semaphore=4,
+                                        is_proxy=True, proxy_pool=pool, meta_cache=MetaCache(),
+                                        slice_backoff_base=0.01)
+        assert result == (2, server.data)
+        stats = {stat["proxy"]: stat for stat in pool.stats()["proxies"]}
+        assert dead.address not in stats or stats[dead.address]["cooling"]  # 失效代理被冷却或剔除
+        assert dead.requests <= 2  # 冷却/剔除后不再租给切片请求
+        assert good.requests >= 16  # 16 个切片(含探测)都经由可用代理完成
+
+
+class ResumeHandler(RangeServerHandler):
+    """记录每个请求的 Range, fail_from 不为 None 时起始偏移不小于该值的切片返回 503, 模拟下载中断"""
+
+    def serve(self):
+        server = self.server.range_server
+        server.ranges.append(self.headers.get("Range"))
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range") or "")
+        if server.fail_from is not None and match and int(match.group(1)) >= server.fail_from:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        super().serve()
+
+
+def resume_server(seed=0):
+    server = RangeServer(size=1024 * 1024, seed=seed)
+    server.server.RequestHandlerClass = ResumeHandler
+    server.ranges = []
+    server.fail_from = None
+    return server
+
+
+def resume_download(server, save_path, **kwargs):
+    events = []
+    kwargs = dict(dict(slice_size=64 * 1024, slice_min_size=1, save_path=save_path, slice_cache=True,
+                       slice_retry_times=1, err_list_retry_times=0, slice_hedge=False, meta_cache=MetaCache(),
+                       slice_hooks=[events.append]), **kwargs)
+    download, result = run_download(ThreadSliceDownload, server.url, **kwargs)
+    start = [event for event in events if event["event"] == "start"]
+    assert len(start) == 1
+    return result, start[0]["resumed"]
+
+
+def range_starts(ranges):
+    return sorted(int(re.match(r"bytes=(\d+)-", value).group(1)) for value in ranges)
+
+
+def test_resume_downloads_only_missing_blocks(tmp_path):
+    save_path = str(tmp_path / "file.bin")
+    with resume_server() as server:
+        server.fail_from = 512 * 1024
+        assert resume_download(server, save_path)[0][0] == 1
+        assert os.path.exists(save_path + ".manifest")
+        server.fail_from = None
+        server.ranges = []
+        result, resumed = resume_download(server, save_path)
+        assert result == (2, save_path) and resumed == 512 * 1024
+        assert server.ranges[0] == "bytes=0-65535"  # 探测请求
+        assert range_starts(server.ranges[1:]) == list(range(512 * 1024, 1024 * 1024, 64 * 1024))
+        with open(save_path, "rb") as f:
+            assert f.read() == server.data
+        assert not os.path.exists(save_path + ".manifest")
+
+
+def test_resume_discards_manifest_when_etag_changes(tmp_path):
+    save_path = str(tmp_path / "file.bin")
+    with resume_server(seed=0) as server:
+        server.fail_from = 512 * 1024
+        assert resume_download(server, save_path)[0][0] == 1
+    with resume_server(seed=1) as server:
+        result, resumed = resume_download(server, save_path)
+        assert result == (2, save_path) and resumed == 0
+        assert range_starts(server.ranges) == list(range(0, 1024 * 1024, 64 * 1024))  # 全部重新下载
+        with open(save_path, "rb") as f:
+            assert f.read() == server.data
+
+
+def test_corrupted_slice_is_downloaded_again(tmp_path):
+    save_path = str(tmp_path / "file.bin")
+    with resume_server() as server:
+        server.fail_from = 512 * 1024
+        assert resume_download(server, save_path, slice_verify=True)[0][0] == 1
+        with open(save_path, "r+b") as f:  # 已完成的 1 号切片在磁盘上损坏
+            f.seek(100 * 1024)
+            f.write(b"\xff" if f.read(1) != b"\xff" else b"\x00")
+        server.fail_from = None
+        server.ranges = []
+        result, resumed = resume_download(server, save_path, slice_verify=True, err_list_retry_times=1)
+        assert result == (2, save_path) and resumed == 512 * 1024
+        assert range_starts(server.ranges[1:]) == [64 * 1024] + list(range(512 * 1024, 1024 * 1024, 64 * 1024))
+        with open(save_path, "rb") as f:
+            assert f.read() == server.data
+
+
+@pytest.mark.parametrize("cls", [ThreadSliceDownload, AsyncSliceDownload])
+def test_wrong_slice_digest_fails_download(cls, tmp_path):
+    with RangeServer(size=1024 * 1024) as server:
+        wrong_slice_digest_download(cls, server, str(tmp_path / "file.bin"))
+
+
+def wrong_slice_digest_download(cls, server, save_path):
+    download, result = run_download(cls, server.url, slice_size=256 * 1024, slice_min_size=1,
+                                    slice_digest="md5:" + "0" * 32, meta_cache=MetaCache())
+    assert result[0] == 1 and result[1] != server.data
+    download, result = run_download(cls, server.url, slice_size=256 * 1024, slice_min_size=1, save_path=save_path,
+                                    slice_digest="md5:" + "0" * 32, meta_cache=MetaCache())
+    assert result[0] == 1 and not os.path.exists(save_path)
+    download, result = run_download(cls, server.url, slice_size=256 * 1024, slice_min_size=1,
+                                    slice_digest=hashlib.md5(server.data).hexdigest(), meta_cache=MetaCache())
+    assert result == (2, server.data)